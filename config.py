@@ -1,10 +1,45 @@
 #
 # Pin assignments for QuickBot, and other configuration parameters.
 #
+import math
+
 BASE_IP = '192.168.0.5'
 ROBOT_IP = '192.168.0.8'
 PORT = 5005
 
+# Hardware backend: 'bbb' for the real robot, 'sim' for the simulated one (see robot/sim.py)
+BACKEND = 'bbb'
+
+# Periods (seconds) of the control loop tasks, and what to do when a task falls behind:
+# 'skip' drops missed runs, 'catch_up' runs them back-to-back (see robot/scheduler.py).
+# Control tick reads encoders and runs wheel speed PID (works up to 500Hz, controller steps by
+# measured time), IR task reads IR sensors, telemetry task pushes state to subscribers (so it limits
+# subscription rate).
+CONTROL_PERIOD = 0.005  # 200Hz
+IR_PERIOD = 0.02  # 50Hz
+TELEMETRY_PERIOD = 0.02  # 50Hz
+SCHEDULER_POLICY = 'skip'
+
+# How often onboard behavior runs (see qb_simple_behavior.py --onboard). Supervisor counts its
+# pauses and moves in behavior ticks, those were tuned at 50Hz.
+BEHAVIOR_PERIOD = 0.02
+
+# Measure time of every stage of the control tick and of command handling (see robot/perf.py).
+# Statistics are queried with $PERF?* command. Adds a few microseconds per tick.
+PERF_ENABLED = False
+
+# Simulator parameters (used only when BACKEND is 'sim'). See robot/sim.py for the full list.
+SIM = {
+    'realtime': True,  # set to False to run faster than real time
+    'arena': [  # wall segments, inches
+        ((-60., -60.), (60., -60.)),
+        ((60., -60.), (60., 60.)),
+        ((60., 60.), (-60., 60.)),
+        ((-60., 60.), (-60., -60.)),
+    ],
+    'start_pose': (0., 0., 0.),  # x, y, theta
+}
+
 MOTOR_LEFT = {
     'dir1': 'P8_14',
     'dir2': 'P8_16',
@@ -25,14 +60,38 @@ MOTOR_RIGHT = {
     'encoder_delay'    : 50
 }
 
+# Robot geometry (inches) for odometry (see robot/odometry.py), also used by the simulator
+WHEEL_RADIUS = 1.3
+WHEEL_BASE = 3.7  # distance between wheels
+TICKS_PER_REV = 16  # encoder ticks per wheel revolution
+
+# PWM duty cycle (percent) is only re-written when it changes by at least that much
+MOTOR_DUTY_RESOLUTION = 0.5
+
 IR_PINS = (3, 1, 5, 6, 4)  # AIN3, AIN1, AIN5, AIN6, AIN4
 
+# IR sensors mounting, in the same order as IR_PINS: direction relative to robot heading (radians,
+# counter-clockwise), distance from robot center (inches), and range (inches; readings at or beyond it
+# see nothing). Used by the occupancy mapper (tools/occupancy.py) and the simulator.
+IR_ANGLES = (math.pi / 2, math.pi / 4, 0., -math.pi / 4, -math.pi / 2)
+IR_OFFSET = 2.5
+IR_RANGE = 32.0
+
 EMA_POW = 11  # 2**EMA_POW is the averaging time of IR readings (in ADC timer ticks)
               # ADC timer runs at about 120000 ticks per second
 
-# IR sensor calibration constants (see fit.py)
+# IR sensor calibration: per-sensor coefficients produced by tools/fit.py (path is relative to this file).
+# If the file does not exist, distance is computed as IR_CALIBRATION / value for all sensors.
+IR_CALIBRATION_FILE = 'ir_calibration.json'
 IR_CALIBRATION = 5555.5
 
+# Telemetry recorder of BotController (see robot/recorder.py): records every control tick into
+# a ring buffer of that many rows (30000 rows = 2.5 minutes at 200Hz, about 4.5MB)
+RECORDER = {
+    'enabled': False,
+    'capacity': 30000,
+}
+
 # Controller parameters
 GO_STRAIGHT = {
     'speed': 40.0,  # how fast do we go?
@@ -0,0 +1,280 @@
+"""
+Wire protocol shared by QBServer and QBClient.
+
+Text protocol: commands are ASCII lines of the form
+
+    $CMD*\n         - action
+    $CMD?*\n        - query
+    $CMD=ARGS*\n    - set
+
+Query replies are lists of numbers: "[1.0, 2.0]\n". This protocol is compatible with
+the MatLab code from the class.
+
+Binary protocol: a client that sent "$BIN=1*\n" (and got "[1]\n" back) may send binary frames.
+Each frame is a fixed header followed by a fixed-layout payload (all little-endian):
+
+    magic   uint8   - always MAGIC, text commands always start with '$' instead
+    type    uint8   - message type (see below)
+    seq     uint16  - sequence number, chosen by the client and echoed in the reply
+    payload         - float32/int32 fields, layout depends on message type and direction
+
+Replies have the same type as the request they answer. Actions and set commands
+(SET_SPEED, RESET_TICKS, SET_POSE, RESET_POSE, END) are not acknowledged, same as in the text protocol.
+
+Telemetry: a client can subscribe to the robot state with "$SUB=<rate>*\n" (or SUBSCRIBE frame),
+where rate is in Hz (zero cancels the subscription). Subscription is not acknowledged. Server
+pushes state snapshots to the client as "$TLM=<values>*\n" lines (or TELEMETRY frames with
+increasing sequence numbers, if the client negotiated binary protocol). Subscription expires
+after SUBSCRIPTION_LEASE seconds unless renewed (by sending the same command again).
+"""
+import collections
+import struct
+
+
+class State(collections.namedtuple('State', 'timer ticks speed ir ir_distances')):
+    """
+    Snapshot of the robot state, taken at a single control tick:
+
+        timer        - ADC timer value
+        ticks        - (left, right) signed encoder ticks
+        speed        - (left, right) signed wheel speed (ticks/sec)
+        ir           - raw IR readings (5-tuple)
+        ir_distances - IR readings converted to distance (5-tuple, inches)
+    """
+
+    __slots__ = ()
+
+    SIZE = 15  # number of values in a flattened state
+
+    def flatten(self):
+        return (self.timer,) + tuple(self.ticks) + tuple(self.speed) + tuple(self.ir) + tuple(self.ir_distances)
+
+    @classmethod
+    def unflatten(cls, values):
+        if len(values) != cls.SIZE:
+            raise ValueError('Expected %d state values, got %d' % (cls.SIZE, len(values)))
+        return cls(values[0], tuple(values[1:3]), tuple(values[3:5]), tuple(values[5:10]), tuple(values[10:15]))
+
+
+def parse_command(line):
+    """
+    Splits text command into (name, kind, args), where kind is '?' for queries, '=' for set
+    commands (|args| is the string after '='), and '' for actions. Returns None if line is not
+    a well-formed command.
+
+        parse_command('$PWM=40,40*\n') -> ('PWM', '=', '40,40')
+    """
+    if line[:1] != '$':
+        return None
+
+    end = line.find('*', 1)
+    if end < 0:
+        return None
+
+    sep = line.find('=', 1, end)
+    if sep >= 0:
+        name, kind, args = line[1:sep], '=', line[sep + 1:end]
+    elif line[end - 1] == '?':
+        name, kind, args = line[1:end - 1], '?', None
+    else:
+        name, kind, args = line[1:end], '', None
+
+    if len(name) < 3 or not name.isupper() or not name.isalpha():
+        return None
+
+    return name, kind, args
+
+
+def format_state(state):
+    return '[%s]\n' % ', '.join(str(x) for x in state.flatten())
+
+
+TELEMETRY_PREFIX = '$TLM='
+
+SUBSCRIPTION_LEASE = 10.0  # seconds
+
+
+def format_telemetry(state):
+    return '%s%s*\n' % (TELEMETRY_PREFIX, ','.join(str(x) for x in state.flatten()))
+
+
+PERF_FIELDS = ('count', 'min', 'mean', 'max', 'p99')
+
+
+def format_perf(summary):
+    """
+    Formats timing statistics (see robot/perf.py) as reply to $PERF?* command. Times are in
+    microseconds:
+
+        [sensors 1000 21.0 24.3 80.1 40.5; helper_left 1000 ...]
+    """
+    stages = []
+    for name, stats in summary:
+        if not stats['count']:
+            continue
+        stages.append('%s %d %.1f %.1f %.1f %.1f' % (
+            name, stats['count'], stats['min'] * 1e6, stats['mean'] * 1e6, stats['max'] * 1e6, stats['p99'] * 1e6))
+    return '[%s]\n' % '; '.join(stages)
+
+
+TASK_FIELDS = ('rate', 'ticks', 'overruns', 'skipped', 'cpu', 'mean', 'p99')
+
+
+def format_tasks(stats):
+    """
+    Formats scheduler task statistics (see robot/scheduler.py) as reply to $TASKS?* command. Rate
+    is in Hz, cpu in percent of the elapsed time, mean and p99 run time in microseconds:
+
+        [control 200.0 1000 0 0 1.2 58.1 90.3; ir 50.0 250 ...]
+    """
+    tasks = []
+    for name, task in stats:
+        run = task['run']
+        tasks.append('%s %.1f %d %d %d %.2f %.1f %.1f' % (
+            name, task['rate'], task['ticks'], task['overruns'], task['skipped'], task['cpu'] * 100,
+            (run['mean'] or 0.) * 1e6, (run['p99'] or 0.) * 1e6))
+    return '[%s]\n' % '; '.join(tasks)
+
+
+GREETING = 'Hello from QuickBot\n'
+
+BINARY_VERSION = 1
+
+MAGIC = 0xB7
+
+HEADER = struct.Struct('<BBH')
+
+# message types
+CHECK = 1
+SET_SPEED = 2
+GET_SPEED = 3
+GET_IR = 4
+GET_IR_DISTANCES = 5
+GET_TICKS = 6
+RESET_TICKS = 7
+GET_STATE = 8
+END = 9
+SUBSCRIBE = 10
+TELEMETRY = 11
+GET_POSE = 12
+SET_POSE = 13
+RESET_POSE = 14
+
+MESSAGE_TYPES = (CHECK, SET_SPEED, GET_SPEED, GET_IR, GET_IR_DISTANCES, GET_TICKS, RESET_TICKS, GET_STATE, END,
+                 SUBSCRIBE, TELEMETRY, GET_POSE, SET_POSE, RESET_POSE)
+
+# payload layouts (without header)
+REQUEST_PAYLOAD = {
+    SET_SPEED: 'ff',
+    SUBSCRIBE: 'f',
+    SET_POSE: 'fff',
+}
+
+REPLY_PAYLOAD = {
+    GET_SPEED: 'ff',
+    GET_IR: '5f',
+    GET_IR_DISTANCES: '5f',
+    GET_TICKS: 'ii',
+    GET_STATE: 'Iiiff5f5f',
+    TELEMETRY: 'Iiiff5f5f',
+    GET_POSE: 'fff',
+}
+
+
+def _frame_structs(payloads):
+    structs = dict((t, struct.Struct(HEADER.format + fmt)) for t, fmt in payloads.items())
+    for t in MESSAGE_TYPES:
+        structs.setdefault(t, HEADER)
+    return structs
+
+
+_REQUEST = _frame_structs(REQUEST_PAYLOAD)
+_REPLY = _frame_structs(REPLY_PAYLOAD)
+
+
+def expects_reply(msg_type):
+    return msg_type == CHECK or (msg_type in REPLY_PAYLOAD and msg_type != TELEMETRY)
+
+
+def is_binary(data):
+    return len(data) >= HEADER.size and ord(data[0]) == MAGIC
+
+
+def is_telemetry(data):
+    if is_binary(data):
+        return ord(data[1]) == TELEMETRY
+    return data.startswith(TELEMETRY_PREFIX)
+
+
+def encode_request(msg_type, seq, *values):
+    return _REQUEST[msg_type].pack(MAGIC, msg_type, seq & 0xffff, *values)
+
+
+def encode_reply(msg_type, seq, *values):
+    return _REPLY[msg_type].pack(MAGIC, msg_type, seq & 0xffff, *values)
+
+
+def _decode(structs, data):
+    if not is_binary(data):
+        raise ValueError('Not a binary frame')
+
+    _, msg_type, seq = HEADER.unpack_from(data)
+    if msg_type not in structs:
+        raise ValueError('Unknown message type: %d' % msg_type)
+
+    s = structs[msg_type]
+    if s is HEADER:
+        return msg_type, seq, data[HEADER.size:]
+
+    if len(data) != s.size:
+        raise ValueError('Bad frame size for message type %d: %d' % (msg_type, len(data)))
+
+    return msg_type, seq, s.unpack(data)[3:]
+
+
+def decode_request_from(buf, size):
+    """
+    Same as decode_request, but decodes first |size| bytes of a bytearray without copying
+    the payload. Returns values as a tuple (payload layouts are fixed), or None for messages
+    without payload.
+    """
+    if size < HEADER.size or buf[0] != MAGIC:
+        raise ValueError('Not a binary frame')
+
+    _, msg_type, seq = HEADER.unpack_from(buf)
+    s = _REQUEST.get(msg_type)
+    if s is None:
+        raise ValueError('Unknown message type: %d' % msg_type)
+
+    if s is HEADER:
+        return msg_type, seq, None
+
+    if size != s.size:
+        raise ValueError('Bad frame size for message type %d: %d' % (msg_type, size))
+
+    return msg_type, seq, s.unpack_from(buf)[3:]
+
+
+def encode_reply_into(buf, msg_type, seq, *values):
+    """
+    Same as encode_reply, but writes frame into a preallocated bytearray. Returns frame size.
+    """
+    s = _REPLY[msg_type]
+    s.pack_into(buf, 0, MAGIC, msg_type, seq & 0xffff, *values)
+    return s.size
+
+
+def decode_request(data):
+    """
+    Returns (type, seq, values). For messages without payload layout |values| is
+    the raw payload string.
+    """
+    return _decode(_REQUEST, data)
+
+
+def decode_reply(data):
+    """
+    Returns (type, seq, values). For messages without payload layout (e.g. CHECK) |values| is
+    the raw payload string.
+    """
+    return _decode(_REPLY, data)
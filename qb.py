@@ -1,9 +1,7 @@
-import time
-import re
-import socket
-
-from tools.fit import distance
+from protocol import State
+from robot.calibration import IRCalibration
 from robot.controller import BotController
+from robot.scheduler import MultiRateScheduler
 
 
 class QB(object):
@@ -15,20 +13,35 @@ class QB(object):
     set_speed(speed_left, speed_right)
 
     get_ir()
+    get_ir_distances()
+    get_ir_into(out), get_ir_distances_into(out) - same, written into a preallocated buffer
 
     get_ticks()
     reset_ticks()
 
     get_speed()
 
-    Recommended sampling frequency is 100Hz.
+    get_state() - all of the above in one snapshot
+
+    get_pose(), set_pose(x, y, theta), reset_pose() - odometry (see robot/odometry.py)
+
+    Periodic work runs from |scheduler| (see robot/scheduler.py): control tick at CONTROL_PERIOD and
+    IR sensor reading at IR_PERIOD (see config.py). Loops that do not use it call on_timer() at 100Hz.
     """
 
     def __init__(self, config):
         self._bot = BotController(config)
+        self.clock = self._bot.clock
+        self.perf = self._bot.perf
+
+        # control tick (encoders and wheel speed) runs faster than IR sensors need to be read,
+        # see robot/scheduler.py. Other tasks (behavior, telemetry) are added by the users of QB.
+        self.scheduler = MultiRateScheduler(config.SCHEDULER_POLICY, clock=self.clock)
+        self.scheduler.add('control', self.on_control, config.CONTROL_PERIOD, priority=0)
+        self.scheduler.add('ir', self.on_ir, getattr(config, 'IR_PERIOD', config.CONTROL_PERIOD), priority=1)
         self._ticks_origin_left = 0
         self._ticks_origin_right = 0
-        self._ir_calibration = config.IR_CALIBRATION
+        self._ir_calibration = IRCalibration.from_config(config)
 
     def start(self):
         self._bot.start()
@@ -37,16 +50,39 @@ class QB(object):
         self._bot.stop()
 
     def on_timer(self):
+        """Reads all sensors and updates wheel speed control (for loops that do not use the scheduler)"""
         self._bot.on_timer()
 
+    def on_control(self):
+        """Control tick without reading IR sensors ('control' task of the scheduler)"""
+        self._bot.on_timer(False)
+
+    def on_ir(self):
+        """Reads IR sensors ('ir' task of the scheduler)"""
+        self._bot.read_ir()
+
     def set_speed(self, speed_left, speed_right):
         self._bot.run(speed_left, speed_right)
 
     def get_ir(self):
         return tuple(self._bot.values)
 
+    def get_ir_into(self, out):
+        """Writes IR readings into |out| (list or array of 5 elements), returns |out|"""
+        values = self._bot.values
+        i = 0
+        count = len(values)
+        while i < count:
+            out[i] = values[i]
+            i += 1
+        return out
+
     def get_ir_distances(self):
-        return tuple( self._ir_calibration / x for x in self._bot.values )
+        return self._ir_calibration.distances(self._bot.values)
+
+    def get_ir_distances_into(self, out):
+        """Writes IR distances into |out| (list or array of 5 elements), returns |out|"""
+        return self._ir_calibration.distances_into(self._bot.values, out)
 
     def get_ticks(self):
         ticks_left, ticks_right = self._bot.ticks
@@ -59,18 +95,49 @@ class QB(object):
     def get_speed(self):
         return self._bot.actual_speed
 
+    def get_state(self):
+        return State(self._bot.timer, self.get_ticks(), self.get_speed(), self.get_ir(), self.get_ir_distances())
+
+    def get_pose(self):
+        """Returns (x, y, theta) integrated from wheel ticks every control tick (inches, radians)"""
+        return self._bot.odometry.pose
+
+    def set_pose(self, x, y, theta):
+        self._bot.odometry.set_pose(x, y, theta)
+
+    def reset_pose(self):
+        self._bot.odometry.reset()
+
+    def get_perf(self):
+        """
+        Returns list of (stage, summary) timing statistics (seconds) of the control tick stages,
+        see robot/perf.py. Empty if PERF_ENABLED is not set in config.
+        """
+        if self.perf is None:
+            return []
+        return self.perf.summary()
+
+    def get_tasks(self):
+        """
+        Returns list of (task, statistics) of the scheduler tasks (see MultiRateScheduler.stats()):
+        rate, cpu (fraction of time spent in the task), run (timing summary), ticks, overruns, skipped.
+        """
+        return self.scheduler.stats()
+
     @classmethod
     def run(cls, config, behavior):
 
         qb = QB(config)
         try:
 
+            qb.scheduler.add('behavior', lambda: behavior(qb),
+                             getattr(config, 'BEHAVIOR_PERIOD', config.CONTROL_PERIOD), priority=2)
+
             qb.start()
+            qb.scheduler.start()
 
             while True:
-                time.sleep(0.01)
-                qb.on_timer()
-                behavior(qb)
+                qb.scheduler.wait()
 
         finally:
             qb.stop()
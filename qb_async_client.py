@@ -0,0 +1,298 @@
+"""
+Pipelined QuickBot client.
+
+QBClient has at most one request in flight and waits for each reply in turn. AsyncQBClient sends
+requests without waiting. Each request is tagged with a sequence number (binary protocol, see protocol.py),
+and returns a Future. A background thread matches replies to futures by robot address and sequence
+number, so a late reply to a timed-out (and re-sent) request can never be mistaken for another one.
+
+Example (all queries of a controller tick are in flight at the same time):
+
+    with AsyncQBClient.connect(config.ROBOT_IP, config.BASE_IP, config.PORT) as qb:
+        ticks, distances = gather(qb.get_ticks(), qb.get_ir_distances())
+        qb.set_speed(40, 40)
+"""
+import contextlib
+import socket
+import threading
+import time
+
+import protocol
+from protocol import State
+
+
+class Future(object):
+    """
+    Result of a request that may not have arrived yet.
+    """
+
+    def __init__(self, transform=None):
+        self._event = threading.Event()
+        self._transform = transform
+        self._value = None
+        self._error = None
+
+    def set_result(self, value):
+        if self._transform is not None:
+            value = self._transform(value)
+        self._value = value
+        self._event.set()
+
+    def set_exception(self, error):
+        self._error = error
+        self._event.set()
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the result. Raises socket.timeout if request timed out."""
+        if not self._event.wait(timeout):
+            raise socket.timeout()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+
+def completed(value=None):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def gather(*futures):
+    """Waits for all futures, returns tuple of their results"""
+    return tuple(f.result() for f in futures)
+
+
+class Request(object):
+    """
+    Request waiting for a reply
+    """
+
+    def __init__(self, future, frame, msg_type, addr, deadline):
+        self.future = future
+        self.frame = frame
+        self.msg_type = msg_type
+        self.addr = addr
+        self.deadline = deadline
+        self.retries = 0
+
+
+class Transport(object):
+    """
+    UDP socket plus a receiver thread that routes replies to pending requests. One transport
+    can talk to any number of robots.
+    """
+
+    BUFFER_SIZE = 1024
+    TIMEOUT = 0.5  # per attempt
+    RETRIES = 3
+    POLL = 0.02  # how often receiver thread checks for timed-out requests
+
+    def __init__(self, base_ip, port):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((base_ip, port))
+        self._sock.settimeout(self.POLL)
+
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._pending = {}  # (addr, seq) -> Request
+        self._text_pending = {}  # addr -> Request (text protocol has no sequence numbers)
+
+        self._running = True
+        self._receiver = threading.Thread(target=self._receive_loop)
+        self._receiver.daemon = True
+        self._receiver.start()
+
+    def close(self):
+        self._running = False
+        self._receiver.join()
+        self._sock.close()
+
+    def request(self, addr, msg_type, *values, **kav):
+        """
+        Sends binary request to |addr|. Returns Future. For messages that have no reply the future
+        is already completed. Keyword argument |transform| is applied to the reply values.
+        """
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xffff
+            seq = self._seq
+            frame = protocol.encode_request(msg_type, seq, *values)
+
+            if not protocol.expects_reply(msg_type):
+                self._sock.sendto(frame, addr)
+                return completed()
+
+            future = Future(kav.get('transform'))
+            self._pending[addr, seq] = Request(future, frame, msg_type, addr, time.time() + self.TIMEOUT)
+            self._sock.sendto(frame, addr)
+
+        return future
+
+    def request_text(self, addr, line, transform=None):
+        """
+        Sends text command and returns Future of the reply line. Only one text request per
+        robot can be in flight (used for protocol negotiation).
+        """
+        future = Future(transform)
+        with self._lock:
+            if addr in self._text_pending:
+                raise RuntimeError('Text request to %s:%s is already in flight' % addr)
+            self._text_pending[addr] = Request(future, line, None, addr, time.time() + self.TIMEOUT)
+            self._sock.sendto(line, addr)
+        return future
+
+    def _receive_loop(self):
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(self.BUFFER_SIZE)
+            except socket.timeout:
+                data = None
+            except socket.error:
+                if not self._running:
+                    break
+                raise
+
+            if data:
+                self._dispatch(data, addr)
+
+            self._expire()
+
+    def _dispatch(self, data, addr):
+        if protocol.is_telemetry(data):
+            return
+
+        if not protocol.is_binary(data):
+            with self._lock:
+                request = self._text_pending.pop(addr, None)
+            if request is not None:
+                request.future.set_result(data)
+            return
+
+        try:
+            msg_type, seq, values = protocol.decode_reply(data)
+        except ValueError:
+            return
+
+        with self._lock:
+            request = self._pending.get((addr, seq))
+            if request is None or request.msg_type != msg_type:
+                return  # duplicate or unexpected reply
+            del self._pending[addr, seq]
+
+        request.future.set_result(values)
+
+    def _expire(self):
+        now = time.time()
+        failed = []
+
+        with self._lock:
+            for table in (self._pending, self._text_pending):
+                for key, request in table.items():
+                    if request.deadline > now:
+                        continue
+
+                    request.retries += 1
+                    if request.retries >= self.RETRIES:
+                        del table[key]
+                        failed.append(request)
+                    else:
+                        request.deadline = now + self.TIMEOUT
+                        self._sock.sendto(request.frame, request.addr)
+
+        for request in failed:
+            request.future.set_exception(socket.timeout())
+
+
+class AsyncQBClient(object):
+    """
+    Implements QB interface, but every method returns a Future instead of a value. Call result()
+    on it to get the value, or use gather() to wait for several requests at once.
+
+    Requires server that supports binary protocol.
+    """
+
+    DEFAULT_PORT = 5005
+
+    def __init__(self, robot_ip, base_ip, port=DEFAULT_PORT, transport=None):
+        self.robot_ip = robot_ip
+        self.base_ip = base_ip
+        self.port = port
+        self.addr = (socket.gethostbyname(robot_ip), port)
+
+        self._own_transport = transport is None
+        self._transport = transport or Transport(base_ip, port)
+
+    def close(self):
+        if self._own_transport:
+            self._transport.close()
+
+    def use_binary(self):
+        """Negotiates binary protocol (see protocol.py). Returns Future of bool."""
+        return self._transport.request_text(self.addr, '$BIN=%d*\n' % protocol.BINARY_VERSION,
+                                            transform=lambda reply: reply.strip() == '[%s]' % protocol.BINARY_VERSION)
+
+    def check(self):
+        return self._request(protocol.CHECK, transform=lambda reply: reply.startswith('Hello from QuickBot'))
+
+    def get_ticks(self):
+        return self._request(protocol.GET_TICKS)
+
+    def reset_ticks(self):
+        return self._request(protocol.RESET_TICKS)
+
+    def set_speed(self, left_val, right_val):
+        return self._request(protocol.SET_SPEED, left_val, right_val)
+
+    def get_speed(self):
+        return self._request(protocol.GET_SPEED)
+
+    def get_ir(self):
+        return self._request(protocol.GET_IR)
+
+    def get_ir_distances(self):
+        return self._request(protocol.GET_IR_DISTANCES)
+
+    def get_state(self):
+        return self._request(protocol.GET_STATE, transform=State.unflatten)
+
+    def get_pose(self):
+        return self._request(protocol.GET_POSE)
+
+    def set_pose(self, x, y, theta):
+        return self._request(protocol.SET_POSE, x, y, theta)
+
+    def reset_pose(self):
+        return self._request(protocol.RESET_POSE)
+
+    def _request(self, msg_type, *values, **kav):
+        return self._transport.request(self.addr, msg_type, *values, **kav)
+
+    @classmethod
+    @contextlib.contextmanager
+    def connect(cls, robot_ip, base_ip, port=DEFAULT_PORT):
+
+        client = cls(robot_ip, base_ip, port)
+
+        try:
+            if not client.use_binary().result():
+                raise RuntimeError('Server does not support binary protocol')
+
+            client.check().result()
+
+            yield client
+
+        finally:
+            client.close()
+
+
+if __name__ == '__main__':
+    import config
+
+    with AsyncQBClient.connect(config.ROBOT_IP, config.BASE_IP, config.PORT) as qb:
+
+        for _ in range(1000):
+            time.sleep(0.1)
+            ticks, speed, distances = gather(qb.get_ticks(), qb.get_speed(), qb.get_ir_distances())
+            print ticks, speed, distances
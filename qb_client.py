@@ -1,80 +1,519 @@
+import collections
 import contextlib
+import Queue
 import re
 import socket
+import threading
 import time
 
+import protocol
+from protocol import State
+from robot.sensors import Sensors
+from robot.stats import Histogram
+
+
+class Snapshot(collections.namedtuple('Snapshot', 'state timestamp')):
+    """
+    Robot state pushed by the server, and the (local) time when it was received.
+    """
+
+    __slots__ = ()
+
+    @property
+    def age(self):
+        return time.time() - self.timestamp
+
+
+class RttEstimator(object):
+    """
+    Round trip time estimator and retransmission timeout, as in TCP (RFC 6298): smoothed RTT and
+    its variance are updated with every measured round trip, timeout is SRTT + 4 * RTTVAR, clamped
+    to [MIN_RTO, MAX_RTO]. Each timeout doubles RTO until the next measurement (backoff).
+
+    Round trips of re-sent requests are not measured, since it is not known which copy was answered.
+    """
+
+    ALPHA = 1 / 8.
+    BETA = 1 / 4.
+    MIN_RTO = 0.01
+    MAX_RTO = 0.5
+    INITIAL_RTO = 0.5
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.rto = self.INITIAL_RTO
+        self.histogram = Histogram(Histogram.log_bounds(1e-4, 10.0, per_decade=20))
+
+        self.requests = 0  # calls that expected a reply
+        self.attempts = 0  # datagrams sent for them (including re-sends)
+        self.timeouts = 0  # attempts that got no reply in time
+        self.failures = 0  # calls that got no reply at all
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.rto = min(max(self.srtt + 4 * self.rttvar, self.MIN_RTO), self.MAX_RTO)
+        self.histogram.add(rtt)
+
+    def backoff(self):
+        self.timeouts += 1
+        self.rto = min(self.rto * 2, self.MAX_RTO)
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'retries': self.attempts - self.requests,
+            'failures': self.failures,
+            'loss_rate': float(self.timeouts) / self.attempts if self.attempts else 0.,
+            'srtt': self.srtt,
+            'rttvar': self.rttvar,
+            'rto': self.rto,
+            'rtt_p50': self.histogram.percentile(50),
+            'rtt_p90': self.histogram.percentile(90),
+            'rtt_p99': self.histogram.percentile(99),
+        }
+
 
 class QBClient:
     """
     Implements QB interface. This is a proxy to the remote QB object running on the robot side.
+
+    Timeouts adapt to the measured round trip time (see RttEstimator), so a lost datagram is re-sent
+    after a few round trips, not after a fixed half second. Each call makes up to RETRIES attempts;
+    |deadline| (seconds, None by default) additionally limits the total time of a call.
     """
 
     BUFFER_SIZE = 1024
 
     DEFAULT_PORT = 5005
 
-    def __init__(self, robot_ip, base_ip, port=DEFAULT_PORT):
+    RETRIES = 3
+
+    SPEED_REFRESH = 1.0  # identical set_speed() is re-sent at least that often (seconds), see enable_cache()
+
+    def __init__(self, robot_ip, base_ip, port=DEFAULT_PORT, deadline=None):
         self.robot_ip = robot_ip
         self.base_ip = base_ip
         self.port = port
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._sock.bind((self.base_ip, self.port))
         self._sock.settimeout(0.5)
+        self.binary = False
+        self._seq = 0
+        self._lock = threading.Lock()  # receiver thread sends subscription renewals, see _next_seq()
+        self.deadline = deadline
+        self.rtt = RttEstimator()
+
+        # telemetry
+        self._rate = 0
+        self._max_age = None
+        self._snapshot = None
+        self._min_timer = None  # telemetry taken at or before this robot timer is dropped, see reset_ticks()
+        self._renew_at = 0
+        self._receiver = None
+        self._replies = Queue.Queue()
+
+        # query cache
+        self._caching = False
+        self._validity = None
+        self._cache = {}  # message type -> (reply, time received)
+        self._last_speed = None  # (left, right, time sent)
+        self.cache_hits = 0
+        self.datagrams_saved = 0
 
     def close(self):
+        if self._rate:
+            self.unsubscribe()
+        self._stop_receiver()
         self._sock.close()
 
+    def subscribe(self, rate, max_age=None):
+        """
+        Asks server to push telemetry at |rate| Hz. Received state is kept by a background thread,
+        and get_ticks(), get_speed(), get_ir(), get_ir_distances() and get_state() return
+        it immediately, as long as it is not older than |max_age| seconds (by default -
+        three telemetry periods). Older data is ignored and the value is queried from the
+        server as usual.
+
+        Returns True when first telemetry datagram has arrived.
+        """
+        self._start_receiver()
+        self._rate = rate
+        self._max_age = max_age if max_age is not None else 3.0 / rate
+
+        for _ in range(3):  # re-try count
+            self._send_subscribe()
+            deadline = time.time() + 0.5
+            while time.time() < deadline:
+                if self._snapshot is not None:
+                    return True
+                time.sleep(0.005)
+
+        return False
+
+    def enable_cache(self, validity=None):
+        """
+        Turns on query caching: results of get_ticks(), get_speed(), get_ir(), get_ir_distances()
+        and get_state() are reused until tick() is called, or for |validity| seconds (if given),
+        whichever comes first. set_speed() with the same values as the last one is not sent (but is
+        re-sent every SPEED_REFRESH seconds, in case the datagram was lost).
+
+        Counters: cache_hits - queries answered from cache, datagrams_saved - datagrams not sent
+        or received because of that.
+        """
+        self._caching = True
+        self._validity = validity
+        self.tick()
+
+    def disable_cache(self):
+        self._caching = False
+        self.tick()
+        self._last_speed = None
+
+    def tick(self):
+        """Marks the start of a new control cycle: cached query results are dropped"""
+        self._cache.clear()
+
+    def unsubscribe(self):
+        self._rate = 0
+        self._send_subscribe()
+        self._snapshot = None
+
+    def latest(self):
+        """Returns last received telemetry Snapshot (or None)"""
+        return self._snapshot
+
+    @property
+    def age(self):
+        """Age of the last received telemetry, in seconds (None if there is none)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return None
+        return snapshot.age
+
+    def _fresh_state(self):
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.age <= self._max_age:
+            return snapshot.state
+
+    def _send_subscribe(self):
+        if self.binary:
+            self._send_recv_frame(protocol.SUBSCRIBE, self._rate)
+        else:
+            self._send_recv('$SUB=%s*\n' % self._rate, False)
+        self._renew_at = time.time() + protocol.SUBSCRIPTION_LEASE / 3
+
+    def _start_receiver(self):
+        if self._receiver is not None:
+            return
+
+        self._receiver = threading.Thread(target=self._receive_loop)
+        self._receiver.daemon = True
+        self._receiver.start()
+
+    def _stop_receiver(self):
+        if self._receiver is None:
+            return
+
+        receiver = self._receiver
+        self._receiver = None
+        receiver.join()
+
+    def _receive_loop(self):
+        """
+        Background thread: routes telemetry to the snapshot, and everything else to the
+        reply queue (see _recv).
+        """
+        while self._receiver is not None:
+            try:
+                data, _ = self._sock.recvfrom(QBClient.BUFFER_SIZE)
+            except socket.timeout:
+                data = None
+
+            if data and protocol.is_telemetry(data):
+                try:
+                    state = parse_telemetry(data)
+                except ValueError:
+                    state = None
+                if state is not None and self._taken_after_reset(state):
+                    self._snapshot = Snapshot(state, time.time())
+            elif data:
+                self._replies.put(data)
+
+            if self._rate and time.time() > self._renew_at:
+                self._send_subscribe()
+
+    def _taken_after_reset(self, state):
+        min_timer = self._min_timer
+        if min_timer is None:
+            return True
+        delta = (state.timer - min_timer) % Sensors.TIMER_MODULUS  # timer wraps around
+        return 0 < delta < Sensors.TIMER_MODULUS / 2
+
+    def _recv(self, timeout):
+        if timeout <= 0:
+            raise socket.timeout()
+
+        if self._receiver is None:
+            self._sock.settimeout(timeout)
+            reply, _ = self._sock.recvfrom(QBClient.BUFFER_SIZE)
+            return reply
+
+        try:
+            return self._replies.get(timeout=timeout)
+        except Queue.Empty:
+            raise socket.timeout()
+
+    def _drain(self):
+        """Drops replies that arrived too late (to requests that already timed out)"""
+        if self._receiver is not None:
+            while not self._replies.empty():
+                self._replies.get_nowait()
+            return
+
+        self._sock.setblocking(0)
+        try:
+            while True:
+                self._sock.recvfrom(QBClient.BUFFER_SIZE)
+        except socket.error:
+            pass
+        finally:
+            self._sock.settimeout(self.rtt.rto)
+
+    def rtt_stats(self):
+        """
+        Returns dictionary of link statistics: requests, retries, failures (requests with no reply
+        at all), loss_rate (fraction of attempts that timed out), srtt, rttvar, rto (current timeout)
+        and round trip time percentiles rtt_p50, rtt_p90, rtt_p99 (seconds).
+        """
+        return self.rtt.stats()
+
+    def use_binary(self):
+        """
+        Asks server to accept binary protocol from this client (see protocol.py). Returns
+        True on success. If server does not support it, client keeps using text protocol.
+        """
+        try:
+            reply = self._send_recv('$BIN=%d*\n' % protocol.BINARY_VERSION)
+        except socket.timeout:
+            return False
+
+        self.binary = parse_tuple(reply) == (protocol.BINARY_VERSION,)
+        return self.binary
+
     def check(self):
-        reply = self._send_recv("$CHECK*\n")
+        if self.binary:
+            reply = self._send_recv_frame(protocol.CHECK)
+        else:
+            reply = self._send_recv("$CHECK*\n")
         return reply.startswith("Hello from QuickBot")
 
     def get_ticks(self):
-        reply = self._send_recv("$ENVAL?*\n")
-        return parse_tuple(reply)
+        state = self._fresh_state()
+        if state is not None:
+            return state.ticks
+        return self._query(protocol.GET_TICKS, "$ENVAL?*\n")
 
     def reset_ticks(self):
-        self._send_recv("$RESET*\n", False)
+        self._cache.clear()
+        if self.binary:
+            self._send_recv_frame(protocol.RESET_TICKS)
+        else:
+            self._send_recv("$RESET*\n", False)
+
+        if self._rate:
+            # telemetry already on its way carries ticks from before the reset: ask for the state (the reply
+            # is sent after the reset is done) and drop snapshots that are not newer than it
+            if self.binary:
+                state = State.unflatten(self._send_recv_frame(protocol.GET_STATE))
+            else:
+                state = State.unflatten(parse_tuple(self._send_recv('$STATE?*\n')))
+            self._min_timer = state.timer
+        self._snapshot = None
 
     def set_speed(self, left_val, right_val):
-        self._send_recv("$PWM=%s,%s*\n" % (left_val, right_val), False)
+        if self._caching:
+            now = time.time()
+            last = self._last_speed
+            if last is not None and last[:2] == (left_val, right_val) and now - last[2] < self.SPEED_REFRESH:
+                self.datagrams_saved += 1
+                return
+            self._last_speed = left_val, right_val, now
+
+        if self.binary:
+            self._send_recv_frame(protocol.SET_SPEED, left_val, right_val)
+        else:
+            self._send_recv("$PWM=%s,%s*\n" % (left_val, right_val), False)
 
     def get_speed(self):
-        reply = self._send_recv("$PWM?*\n")
-        return parse_tuple(reply)
+        state = self._fresh_state()
+        if state is not None:
+            return state.speed
+        return self._query(protocol.GET_SPEED, "$PWM?*\n")
 
     def get_ir(self):
-        reply = self._send_recv('$IRVAL?*\n')
-        return parse_tuple(reply)
+        state = self._fresh_state()
+        if state is not None:
+            return state.ir
+        return self._query(protocol.GET_IR, '$IRVAL?*\n')
 
     def get_ir_distances(self):
-        reply = self._send_recv('$IRDIST?*\n')
-        return parse_tuple(reply)
+        state = self._fresh_state()
+        if state is not None:
+            return state.ir_distances
+        return self._query(protocol.GET_IR_DISTANCES, '$IRDIST?*\n')
 
-    def _send_recv(self, message, expect_reply=True):
+    def get_state(self):
+        state = self._fresh_state()
+        if state is not None:
+            return state
+        return State.unflatten(self._query(protocol.GET_STATE, '$STATE?*\n'))
 
-        for _ in range(3):  # re-try count
-            try:
-                self._sock.sendto(message, (self.robot_ip, self.port))
+    def get_pose(self):
+        """Returns (x, y, theta) of the robot, integrated onboard every control tick (see QB.get_pose())"""
+        return self._query(protocol.GET_POSE, '$POSE?*\n')
+
+    def set_pose(self, x, y, theta):
+        self._cache.pop(protocol.GET_POSE, None)
+        if self.binary:
+            self._send_recv_frame(protocol.SET_POSE, x, y, theta)
+        else:
+            self._send_recv('$POSE=%s,%s,%s*\n' % (x, y, theta), False)
+
+    def reset_pose(self):
+        self._cache.pop(protocol.GET_POSE, None)
+        if self.binary:
+            self._send_recv_frame(protocol.RESET_POSE)
+        else:
+            self._send_recv('$RESETPOSE*\n', False)
+
+    def set_param(self, name, value):
+        """
+        Changes parameter of the behavior running onboard (see QBServer), e.g.
+        set_param('GO_STRAIGHT.speed', 30). Returns False if there is no such parameter.
+        """
+        return parse_tuple(self._send_recv('$PARAM=%s,%s*\n' % (name, value))) == (1.0,)
+
+    def get_perf(self):
+        """
+        Timing statistics of the robot control tick and command handling (text command,
+        also in binary mode). See parse_perf().
+        """
+        return parse_perf(self._send_recv('$PERF?*\n'))
+
+    def get_tasks(self):
+        """
+        Scheduler statistics of the robot tasks (control, ir, telemetry, behavior): text command,
+        also in binary mode. See parse_tasks().
+        """
+        return parse_tasks(self._send_recv('$TASKS?*\n'))
+
+    def _query(self, msg_type, command):
+        if self._caching:
+            cached = self._cache.get(msg_type)
+            if cached is not None and (self._validity is None or time.time() - cached[1] <= self._validity):
+                self.cache_hits += 1
+                self.datagrams_saved += 2  # request and reply
+                return cached[0]
 
-                if not expect_reply:
-                    return
+        if self.binary:
+            reply = self._send_recv_frame(msg_type)
+        else:
+            reply = parse_tuple(self._send_recv(command))
 
-                reply, _ = self._sock.recvfrom(QBClient.BUFFER_SIZE)
-                return reply
+        if self._caching:
+            self._cache[msg_type] = reply, time.time()
+        return reply
+
+    def _send_recv(self, message, expect_reply=True, match=None):
+        """
+        Sends |message| and returns the reply. Re-sends it when no reply arrives within the current
+        retransmission timeout, up to RETRIES attempts (and no longer than |deadline|, if set).
+        |match| (if given) is called with each received datagram and returns the reply value,
+        or None to ignore the datagram and keep waiting. Raises socket.timeout if there is no reply.
+        """
+        addr = (self.robot_ip, self.port)
+        if not expect_reply:
+            self._sock.sendto(message, addr)
+            return
+
+        rtt = self.rtt
+        rtt.requests += 1
+        start = time.time()
+        call_deadline = start + self.deadline if self.deadline is not None else None
+
+        if match is None:
+            # text replies can not be told apart, so make sure no stale one is waiting
+            self._drain()
+
+        for attempt in range(self.RETRIES):
+            sent = time.time()
+            attempt_deadline = sent + rtt.rto
+            if call_deadline is not None:
+                attempt_deadline = min(attempt_deadline, call_deadline)
+            self._sock.sendto(message, addr)
+            rtt.attempts += 1
+
+            try:
+                while True:
+                    reply = self._recv(attempt_deadline - time.time())
+                    value = reply if match is None else match(reply)
+                    if value is not None:
+                        if attempt == 0:
+                            rtt.sample(time.time() - sent)
+                        return value
             except socket.timeout:
-                pass
+                rtt.backoff()
 
+            if call_deadline is not None and time.time() >= call_deadline:
+                break
+
+        rtt.failures += 1
         raise socket.timeout()
 
+    def _next_seq(self):
+        with self._lock:
+            self._seq = (self._seq + 1) & 0xffff
+            return self._seq
+
+    def _send_recv_frame(self, msg_type, *values):
+        """
+        Binary counterpart of _send_recv. Replies are matched to the request by sequence number,
+        so a late reply to an earlier (timed out) request is never mistaken for this one.
+        """
+        seq = self._next_seq()
+        frame = protocol.encode_request(msg_type, seq, *values)
+
+        if not protocol.expects_reply(msg_type):
+            self._send_recv(frame, False)
+            return
+
+        def match(reply):
+            if not protocol.is_binary(reply):
+                return None
+            reply_type, reply_seq, values = protocol.decode_reply(reply)
+            if reply_type == msg_type and reply_seq == seq:
+                return values
+
+        return self._send_recv(frame, match=match)
+
     @classmethod
     @contextlib.contextmanager
-    def connect(cls, robot_ip, base_ip, port=DEFAULT_PORT):
+    def connect(cls, robot_ip, base_ip, port=DEFAULT_PORT, binary=False):
 
         client = QBClient(robot_ip, base_ip, port)
 
         try:
             client.check()
 
+            if binary:
+                client.use_binary()
+
             yield client
 
         finally:
@@ -86,6 +525,44 @@ def parse_tuple(reply):
     return tuple(float(x) for x in reply.split())
 
 
+def parse_perf(reply):
+    """
+    Parses reply to $PERF?* command into a list of (stage, {count, min, mean, max, p99}),
+    times in microseconds.
+    """
+    reply = reply.strip().strip('[]')
+    result = []
+    for stage in reply.split(';'):
+        parts = stage.split()
+        if parts:
+            values = [int(parts[1])] + [float(x) for x in parts[2:]]
+            result.append((parts[0], dict(zip(protocol.PERF_FIELDS, values))))
+    return result
+
+
+def parse_tasks(reply):
+    """
+    Parses reply to $TASKS?* command into a list of (task, {rate, ticks, overruns, skipped, cpu, mean, p99}):
+    rate in Hz, cpu in percent, run times in microseconds.
+    """
+    reply = reply.strip().strip('[]')
+    result = []
+    for task in reply.split(';'):
+        parts = task.split()
+        if parts:
+            values = [float(parts[1])] + [int(x) for x in parts[2:5]] + [float(x) for x in parts[5:]]
+            result.append((parts[0], dict(zip(protocol.TASK_FIELDS, values))))
+    return result
+
+
+def parse_telemetry(data):
+    if protocol.is_binary(data):
+        _, _, values = protocol.decode_reply(data)
+    else:
+        values = parse_tuple(data[len(protocol.TELEMETRY_PREFIX):data.index('*')])
+    return State.unflatten(values)
+
+
 if __name__ == '__main__':
     import config
 
@@ -0,0 +1,194 @@
+"""
+Controls several QuickBots from one base station process.
+
+All robots share a single UDP socket (see Transport in qb_async_client.py). Replies are routed back by robot
+address and sequence number, so requests to all robots are in flight at the same time and the cost of a
+control tick does not grow with the number of robots.
+
+Example:
+
+    with Fleet.connect(['192.168.0.8', '192.168.0.9'], config.BASE_IP, config.PORT) as fleet:
+        while True:
+            states = fleet.get_state()  # one State per robot, queried concurrently
+            fleet.set_speed([(40, 40), (40, -40)])
+
+            first = fleet[0]  # per-robot proxy with the QB API
+            print first.get_ir_distances()
+"""
+import contextlib
+
+from qb_async_client import AsyncQBClient, Transport, gather
+
+
+class RobotProxy(object):
+    """
+    Implements QB interface for one robot of a fleet. Each call waits for its reply; to query all
+    robots at once use Fleet methods, or |futures| (an AsyncQBClient) of several proxies.
+    """
+
+    def __init__(self, futures):
+        self.futures = futures
+        self.robot_ip = futures.robot_ip
+        self.addr = futures.addr
+
+    def check(self):
+        return self.futures.check().result()
+
+    def get_ticks(self):
+        return self.futures.get_ticks().result()
+
+    def reset_ticks(self):
+        self.futures.reset_ticks().result()
+
+    def set_speed(self, left_val, right_val):
+        self.futures.set_speed(left_val, right_val).result()
+
+    def get_speed(self):
+        return self.futures.get_speed().result()
+
+    def get_ir(self):
+        return self.futures.get_ir().result()
+
+    def get_ir_distances(self):
+        return self.futures.get_ir_distances().result()
+
+    def get_state(self):
+        return self.futures.get_state().result()
+
+    def get_pose(self):
+        return self.futures.get_pose().result()
+
+    def set_pose(self, x, y, theta):
+        self.futures.set_pose(x, y, theta).result()
+
+    def reset_pose(self):
+        self.futures.reset_pose().result()
+
+
+class Fleet(object):
+    """
+    Set of robots sharing one transport. Methods named after QB ones send the request to every
+    robot, then wait for all replies, and return a list of results (in the order robots were added).
+    """
+
+    def __init__(self, base_ip, port=AsyncQBClient.DEFAULT_PORT):
+        self.base_ip = base_ip
+        self.port = port
+        self._transport = Transport(base_ip, port)
+        self.robots = []
+
+    def close(self):
+        self._transport.close()
+
+    def add(self, robot_ip, port=None):
+        """Adds robot listening at |robot_ip| (and |port|, by default the same as base station one)"""
+        client = AsyncQBClient(robot_ip, self.base_ip, port or self.port, transport=self._transport)
+        robot = RobotProxy(client)
+        self.robots.append(robot)
+        return robot
+
+    def __len__(self):
+        return len(self.robots)
+
+    def __getitem__(self, index):
+        return self.robots[index]
+
+    def __iter__(self):
+        return iter(self.robots)
+
+    def call(self, method, *args):
+        """
+        Calls AsyncQBClient |method| with the same |args| for every robot concurrently, returns
+        list of results
+        """
+        return list(gather(*[getattr(robot.futures, method)(*args) for robot in self.robots]))
+
+    def use_binary(self):
+        return self.call('use_binary')
+
+    def check(self):
+        return self.call('check')
+
+    def get_ticks(self):
+        return self.call('get_ticks')
+
+    def reset_ticks(self):
+        self.call('reset_ticks')
+
+    def set_speed(self, speeds):
+        """|speeds| is a list of (left, right) tuples, one per robot"""
+        if len(speeds) != len(self.robots):
+            raise ValueError('Expected %d speed pairs, got %d' % (len(self.robots), len(speeds)))
+        gather(*[robot.futures.set_speed(left, right) for robot, (left, right) in zip(self.robots, speeds)])
+
+    def get_speed(self):
+        return self.call('get_speed')
+
+    def get_ir(self):
+        return self.call('get_ir')
+
+    def get_ir_distances(self):
+        return self.call('get_ir_distances')
+
+    def get_state(self):
+        return self.call('get_state')
+
+    def get_pose(self):
+        return self.call('get_pose')
+
+    def set_pose(self, poses):
+        """|poses| is a list of (x, y, theta) tuples, one per robot"""
+        if len(poses) != len(self.robots):
+            raise ValueError('Expected %d poses, got %d' % (len(self.robots), len(poses)))
+        gather(*[robot.futures.set_pose(*pose) for robot, pose in zip(self.robots, poses)])
+
+    def reset_pose(self):
+        self.call('reset_pose')
+
+    @classmethod
+    @contextlib.contextmanager
+    def connect(cls, robot_ips, base_ip, port=AsyncQBClient.DEFAULT_PORT):
+        """
+        Creates fleet of robots at |robot_ips| (IP addresses or (IP, port) tuples), negotiates binary
+        protocol with all of them. On exit stops all robots.
+        """
+        fleet = cls(base_ip, port)
+
+        try:
+            for robot in robot_ips:
+                if isinstance(robot, tuple):
+                    fleet.add(*robot)
+                else:
+                    fleet.add(robot)
+
+            for robot, ok in zip(fleet, fleet.use_binary()):
+                if not ok:
+                    raise RuntimeError('Robot %s does not support binary protocol' % robot.robot_ip)
+
+            fleet.check()
+
+            yield fleet
+
+        finally:
+            try:
+                fleet.set_speed([(0, 0)] * len(fleet))
+            except Exception:
+                pass  # unreachable robot must not hide the original error or keep the fleet open
+            finally:
+                fleet.close()
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    import config
+
+    robot_ips = sys.argv[1:] or [config.ROBOT_IP]
+
+    with Fleet.connect(robot_ips, config.BASE_IP, config.PORT) as fleet:
+
+        for _ in range(1000):
+            time.sleep(0.1)
+            for robot, state in zip(fleet, fleet.get_state()):
+                print robot.robot_ip, state.ticks, state.speed, state.ir_distances
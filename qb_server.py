@@ -1,19 +1,51 @@
-import re
+import errno
+import math
+import select
 import socket
 
 from qb import QB
+import protocol
+from protocol import format_perf, format_state, format_tasks, format_telemetry
+
+
+class Subscription(object):
+    """
+    Telemetry subscription of one client
+    """
+
+    def __init__(self, every, expires):
+        self.every = every  # push every that many telemetry ticks
+        self.countdown = 0
+        self.expires = expires
+        self.seq = 0
 
 
 class QBServer(QB):
-    """The QuickBot Class. Just a UDP proxy on top of QB class functionality"""
+    """
+    The QuickBot Class. Just a UDP proxy on top of QB class functionality
+
+    Commands are dispatched through lookup tables: text commands by (name, kind) (see
+    protocol.parse_command), binary ones by message type. Use register_command() and
+    register_frame() to add new ones.
 
-    SAMPLE_TIME = 0.01  # 100Hz
+    Control tick, IR reading, onboard behavior and telemetry are tasks of the scheduler (see QB and
+    robot/scheduler.py), commands are handled while no task is due.
 
-    def __init__(self, config):
+    If |behavior| is given, it runs onboard, called as behavior(qb) every BEHAVIOR_PERIOD seconds
+    (after control tick, if both are due). Server then only serves monitoring queries: remote motion
+    commands are ignored, and $PARAM=name,value* changes behavior parameters (if behavior has
+    set_param(name, value) method).
+    """
+
+    MAX_BATCH = 64  # max number of datagrams handled between two control ticks
+
+    BUFFER_SIZE = 1024
+
+    def __init__(self, config, behavior=None):
         QB.__init__(self, config)
 
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._sock.settimeout(self.SAMPLE_TIME)
+        self._sock.setblocking(0)
 
         # Set IP addresses
         self.base_ip  = config.BASE_IP
@@ -22,81 +54,339 @@ class QBServer(QB):
 
         self._sock.bind((self.robot_ip, self.port))
 
+        self._binary_clients = set()  # addresses of clients that negotiated binary protocol
+        self._subscriptions = {}  # address -> Subscription
+        self._telemetry_period = getattr(config, 'TELEMETRY_PERIOD', config.CONTROL_PERIOD)
+        self.scheduler.add('telemetry', self.publish, self._telemetry_period, priority=3)
+
+        self.behavior = behavior
+        if behavior is not None:
+            self.scheduler.add('behavior', lambda: self.behavior(self),
+                               getattr(config, 'BEHAVIOR_PERIOD', config.CONTROL_PERIOD), priority=2)
+
+        # receive and (binary) send buffers are allocated once
+        self._in = bytearray(self.BUFFER_SIZE)
+        self._in_view = memoryview(self._in)
+        self._out = bytearray(self.BUFFER_SIZE)
+        self._out_view = memoryview(self._out)
+
+        self._commands = {}  # (name, kind) -> handler(args, addr)
+        self._frames = {}  # message type -> handler(seq, args, addr)
+
+        # timing of command handling (see robot/perf.py)
+        if self.perf is not None:
+            self._parse_stage = self.perf.stage('parse')
+            self._reply_stage = self.perf.stage('reply')
+
+        self.register_command('CHECK', '', self._check)
+        self.register_command('CHECK', '?', self._check)
+        self.register_command('PWM', '?', self._query(self.get_speed, '[%s,%s]\n'))
+        self.register_command('PWM', '=', self._set_speed)
+        self.register_command('IRVAL', '?', self._query(self.get_ir, '[%s, %s, %s, %s, %s]\n'))
+        self.register_command('IRDIST', '?', self._query(self.get_ir_distances, '[%s, %s, %s, %s, %s]\n'))
+        self.register_command('ENVAL', '?', self._query(self.get_ticks, '[%s, %s]\n'))
+        self.register_command('ENVEL', '?', self._query(self.get_speed, '[%s, %s]\n'))
+        self.register_command('STATE', '?', lambda args, addr: self.send_line(format_state(self.get_state()), addr))
+        self.register_command('PERF', '?', lambda args, addr: self.send_line(format_perf(self.get_perf()), addr))
+        self.register_command('TASKS', '?', lambda args, addr: self.send_line(format_tasks(self.get_tasks()), addr))
+        self.register_command('BIN', '=', self._binary)
+        self.register_command('SUB', '=', lambda args, addr: self.subscribe(addr, float(args)))
+        self.register_command('RESET', '', lambda args, addr: self.reset_ticks())
+        self.register_command('POSE', '?', self._query(self.get_pose, '[%s, %s, %s]\n'))
+        self.register_command('POSE', '=', self._set_pose)
+        self.register_command('RESETPOSE', '', lambda args, addr: self.reset_pose())
+        self.register_command('PARAM', '=', self._set_param)
+        self.register_command('END', '', lambda args, addr: False)
+
+        self.register_frame(protocol.CHECK, self._check_frame)
+        self.register_frame(protocol.SET_SPEED, lambda seq, args, addr: self.set_speed(*args))
+        for msg_type, getter in ((protocol.GET_SPEED, self.get_speed),
+                                 (protocol.GET_IR, self.get_ir),
+                                 (protocol.GET_IR_DISTANCES, self.get_ir_distances),
+                                 (protocol.GET_TICKS, self.get_ticks),
+                                 (protocol.GET_STATE, lambda: self.get_state().flatten()),
+                                 (protocol.GET_POSE, self.get_pose)):
+            self.register_frame(msg_type, self._query_frame(msg_type, getter))
+        self.register_frame(protocol.SUBSCRIBE, lambda seq, args, addr: self.subscribe(addr, args[0]))
+        self.register_frame(protocol.RESET_TICKS, lambda seq, args, addr: self.reset_ticks())
+        self.register_frame(protocol.SET_POSE, lambda seq, args, addr: self.set_pose(*args))
+        self.register_frame(protocol.RESET_POSE, lambda seq, args, addr: self.reset_pose())
+        self.register_frame(protocol.END, lambda seq, args, addr: False)
+
+        if behavior is not None:
+            # motors are driven by the onboard behavior
+            self.register_command('PWM', '=', lambda args, addr: None)
+            self.register_frame(protocol.SET_SPEED, lambda seq, args, addr: None)
+
+    def register_command(self, name, kind, handler):
+        """
+        Registers handler for a text command. |kind| is '?' for queries, '=' for set commands and ''
+        for actions. Handler is called as handler(args, addr), where |args| is the string after '='
+        (None for other kinds) and |addr| is the client address. Handler returns False to stop
+        the server.
+
+        An action also answers its query and set forms, unless they have handlers of their own
+        ($RESET?*, $END=1* act as $RESET*, $END*, as with the original regex parser).
+        """
+        self._commands[name, kind] = handler
+
+    def register_frame(self, msg_type, handler):
+        """
+        Registers handler for a binary command. Handler is called as handler(seq, args, addr),
+        where |args| is the tuple of payload values (None if there is no payload).
+        """
+        self._frames[msg_type] = handler
+
     def stop(self):
         QB.stop(self)
         self._sock.close()
 
-    def recv_line(self):
+    def recv_into(self):
+        """
+        Receives pending datagram into the input buffer. Returns (size, sender address),
+        or (0, None) if nothing is pending.
+        """
         try:
-            return self._sock.recv(1024)
-        except socket.timeout:
-            pass
+            return self._sock.recvfrom_into(self._in)
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        return 0, None
 
-    def send_line(self, line):
-        self._sock.sendto(line, (self.base_ip, self.port))
+    def send_line(self, line, addr=None):
+        """
+        Sends reply to the given address (by default - to the base station)
+        """
+        self._sock.sendto(line, addr or (self.base_ip, self.port))
 
-    @classmethod
-    def run(cls, config):
+    def send_frame(self, msg_type, seq, values, addr):
+        """
+        Sends binary reply, built in the preallocated output buffer
+        """
+        size = protocol.encode_reply_into(self._out, msg_type, seq, *values)
+        self._sock.sendto(self._out_view[:size], addr)
 
-        qb = QBServer(config)
-        qb.start()
+    def serve(self):
+        """
+        Main loop. Runs scheduler tasks when they are due, and in between handles incoming commands
+        as soon as they arrive. Returns when END command is received.
+        """
+        while True:
+            timeout = self.scheduler.time_to_deadline()
+            if timeout > 0:
+                readable, _, _ = select.select([self._sock], [], [], timeout)
+                if readable:
+                    if not self.drain():
+                        return
+                    continue
 
-        print 'QuickBot is ready.'
-        print 'Base IP is', qb.base_ip
-        print 'Robot IP is', qb.robot_ip
-        print 'Port is', qb.port
+                # clock may be simulated (see robot/sim.py) and not follow wall time
+                timeout = self.scheduler.time_to_deadline()
+                if timeout > 0:
+                    self.clock.sleep(timeout)
+
+            self.scheduler.run_pending()
+
+    def subscribe(self, addr, rate):
+        """
+        Starts (or renews) pushing telemetry to |addr| at |rate| Hz. Zero rate cancels subscription.
+        Raises ValueError if |rate| is not a finite number.
+        """
+        if math.isnan(rate) or math.isinf(rate):
+            raise ValueError('Invalid telemetry rate: %r' % rate)
+        if rate <= 0:
+            self._subscriptions.pop(addr, None)
+            return
+
+        every = max(1, int(round(1.0 / (rate * self._telemetry_period))))
+        expires = self.clock.time() + protocol.SUBSCRIPTION_LEASE
+
+        sub = self._subscriptions.get(addr)
+        if sub is None:
+            self._subscriptions[addr] = Subscription(every, expires)
+        else:
+            sub.every = every
+            sub.expires = expires
+
+    def publish(self):
+        """
+        Pushes telemetry to subscribers that are due ('telemetry' task, every TELEMETRY_PERIOD).
+        """
+        if not self._subscriptions:
+            return
+
+        now = self.clock.time()
+        state = None
+        for addr, sub in self._subscriptions.items():
+            if now > sub.expires:
+                del self._subscriptions[addr]
+                continue
+
+            sub.countdown -= 1
+            if sub.countdown > 0:
+                continue
+            sub.countdown = sub.every
+
+            if state is None:
+                state = self.get_state()
+
+            sub.seq += 1
+            if addr in self._binary_clients:
+                self.send_frame(protocol.TELEMETRY, sub.seq, state.flatten(), addr)
+            else:
+                self.send_line(format_telemetry(state), addr)
+
+    def drain(self):
+        """
+        Handles all pending datagrams without blocking (but no more than MAX_BATCH, so that
+        a flood of commands can not starve the control loop). Returns False if END
+        command was received.
+        """
+        for _ in range(self.MAX_BATCH):
+            size, addr = self.recv_into()
+            if not size:
+                break
+
+            if self._in[0] == protocol.MAGIC:
+                if self.handle_frame(size, addr) is False:
+                    return False
+
+            elif self.handle_line(self._in_view[:size].tobytes(), addr) is False:
+                return False
+
+        return True
+
+    def handle_line(self, line, addr=None):
+        """
+        Executes one text command. Replies go to |addr|. Returns False if this was END command.
+        """
+        timer = self.perf.timer if self.perf is not None else None
+        if timer:
+            t0 = timer()
+
+        cmd = protocol.parse_command(line)
+        if cmd is None:
+            print 'Unexpected command, ignoring:', line
+            return True
+
+        name, kind, args = cmd
+        handler = self._commands.get((name, kind))
+        if handler is None:
+            handler = self._commands.get((name, ''))  # action sent as a query or set command
+            if handler is None:
+                return True
+            args = None
+
+        if timer:
+            t1 = timer()
+            self._parse_stage.add(t1 - t0)
 
         try:
+            return handler(args, addr)
+        except (ValueError, IndexError):
+            print 'Malformed %s command, ignoring:' % name, line
+            return True
+        finally:
+            if timer:
+                self._reply_stage.add(timer() - t1)
 
-            while True:
-                qb.on_timer()
-                line = qb.recv_line()
-                if not line:
-                    continue
+    def handle_frame(self, size, addr):
+        """
+        Executes binary command sitting in the input buffer. Returns False if this was END command.
+        """
+        if addr not in self._binary_clients:
+            print 'Binary command from a client that did not negotiate binary protocol, ignoring'
+            return True
 
-                mtc = re.match(r'\$(?P<CMD>[A-Z]{3,})(?P<SET>=?)(?P<QUERY>\??)(?(2)(?P<ARGS>.*)).*\*', line)
-                if not mtc:
-                    print 'Unexpected command, ignoring:', line
-                    continue
+        timer = self.perf.timer if self.perf is not None else None
+        if timer:
+            t0 = timer()
 
-                if mtc.group('CMD') == 'CHECK':
-                    qb.send_line('Hello from QuickBot\n')
+        try:
+            msg_type, seq, args = protocol.decode_request_from(self._in, size)
+        except ValueError as e:
+            print 'Malformed binary command, ignoring:', e
+            return True
 
-                elif mtc.group('CMD') == 'PWM':
-                    if mtc.group('QUERY'):
-                        qb.send_line('[%s,%s]\n' % qb.get_speed())
+        handler = self._frames.get(msg_type)
+        if handler is None:
+            return True
 
-                    elif mtc.group('SET') and mtc.group('ARGS'):
-                        args = mtc.group('ARGS')
-                        parts = args.split(',')
-                        speed_left = float(parts[0].strip())
-                        speed_right = float(parts[1].strip())
-                        qb.set_speed(speed_left, speed_right)
+        if timer:
+            t1 = timer()
+            self._parse_stage.add(t1 - t0)
 
-                    else:
-                        print 'Malformed PWM command, ignoring:', line
+        try:
+            return handler(seq, args, addr)
+        except (ValueError, IndexError) as e:
+            print 'Malformed binary command %d, ignoring:' % msg_type, e
+            return True
+        finally:
+            if timer:
+                self._reply_stage.add(timer() - t1)
+
+    def _query(self, getter, fmt):
+        def handler(args, addr):
+            self.send_line(fmt % getter(), addr)
+        return handler
+
+    def _query_frame(self, msg_type, getter):
+        def handler(seq, args, addr):
+            self.send_frame(msg_type, seq, getter(), addr)
+        return handler
+
+    def _check(self, args, addr):
+        self.send_line(protocol.GREETING, addr)
 
-                elif mtc.group('CMD') == 'IRVAL':
-                    if mtc.group('QUERY'):
-                        qb.send_line('[%s, %s, %s, %s, %s]\n' % qb.get_ir())
+    def _set_speed(self, args, addr):
+        parts = args.split(',')
+        speed_left = float(parts[0].strip())
+        speed_right = float(parts[1].strip())
+        self.set_speed(speed_left, speed_right)
 
-                elif mtc.group('CMD') == 'IRDIST':
-                    if mtc.group('QUERY'):
-                        qb.send_line('[%s, %s, %s, %s, %s]\n' % qb.get_ir_distances())
+    def _set_pose(self, args, addr):
+        x, y, theta = [float(x.strip()) for x in args.split(',')]
+        self.set_pose(x, y, theta)
 
-                elif mtc.group('CMD') == 'ENVAL':
-                    if mtc.group('QUERY'):
-                        qb.send_line('[%s, %s]\n' % qb.get_ticks())
+    def _set_param(self, args, addr):
+        name, value = args.split(',')
+        set_param = getattr(self.behavior, 'set_param', None)
+        try:
+            if set_param is None:
+                raise KeyError(name)
+            set_param(name.strip(), float(value))
+        except KeyError:
+            self.send_line('[0]\n', addr)
+        else:
+            self.send_line('[1]\n', addr)
+
+    def _binary(self, args, addr):
+        if args.strip() == str(protocol.BINARY_VERSION):
+            self._binary_clients.add(addr)
+            self.send_line('[%s]\n' % protocol.BINARY_VERSION, addr)
+        else:
+            self._binary_clients.discard(addr)
+            self.send_line('[0]\n', addr)
 
-                elif mtc.group('CMD') == 'ENVEL':
-                    if mtc.group('QUERY'):
-                        qb.send_line('[%s, %s]\n' % qb.get_speed())
+    def _check_frame(self, seq, args, addr):
+        self.send_line(protocol.encode_reply(protocol.CHECK, seq) + protocol.GREETING, addr)
 
-                elif mtc.group('CMD') == 'RESET':
-                    qb.reset_ticks()
+    @classmethod
+    def run(cls, config, behavior=None):
 
-                elif mtc.group('CMD') == 'END':
-                    break
+        qb = QBServer(config, behavior)
+        qb.start()
+        qb.scheduler.start()
+
+        print 'QuickBot is ready.'
+        if behavior is not None:
+            print 'Running behavior onboard, remote motion commands are ignored'
+        print 'Base IP is', qb.base_ip
+        print 'Robot IP is', qb.robot_ip
+        print 'Port is', qb.port
+
+        try:
+            qb.serve()
 
         finally:
             qb.stop()
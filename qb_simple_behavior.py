@@ -13,7 +13,17 @@ Simple behavior, contains three controllers:
 Bot goes straight until it hits an obstacle. It then brakes and backtracks.
 Then it start rotating, looking for a direction where there is no obstacles.
 When found, it will run straight.
+
+Run it from the base station (every sensor read and motor command goes over the network):
+
+    python qb_simple_behavior.py
+
+or on the robot itself, with no network in the loop (QBServer keeps serving monitoring
+queries and $PARAM=name,value* parameter changes, e.g. $PARAM=GO_STRAIGHT.speed,30*):
+
+    python qb_simple_behavior.py --onboard
 """
+import argparse
 import time
 from qb_client import QBClient
 
@@ -136,8 +146,17 @@ class Supervisor:
     """
     Implements behavior by utilizing three controllers and managing
     transitions between these controllers.
+
+    Supervisor is a behavior callable: supervisor(qb) is the same as supervisor.execute(qb).
     """
 
+    # parameter section (as in config.py) -> controller attribute
+    SECTIONS = {
+        'GO_STRAIGHT': '_go_straight',
+        'AVOID_COLLISION': '_avoid_collision',
+        'FIND_NEW_DIRECTION': '_find_new_direction',
+    }
+
     def __init__(self, config):
 
         self._go_straight = GoStraightController(
@@ -166,6 +185,23 @@ class Supervisor:
     def execute(self, qb):
         return self.current.execute(qb)
 
+    __call__ = execute
+
+    def set_param(self, name, value):
+        """
+        Changes controller parameter, |name| is "SECTION.key" as in config.py, e.g. "GO_STRAIGHT.speed".
+        Raises KeyError if there is no such parameter.
+        """
+        section, _, key = name.partition('.')
+        if section not in self.SECTIONS:
+            raise KeyError(name)
+
+        controller = getattr(self, self.SECTIONS[section])
+        attr = '_' + key
+        if not hasattr(controller, attr):
+            raise KeyError(name)
+        setattr(controller, attr, type(getattr(controller, attr))(value))
+
     def on_obstacle(self):
         self.current = self._avoid_collision
         self.current.reset()
@@ -183,16 +219,33 @@ if __name__ == '__main__':
 
     import config
 
+    parser = argparse.ArgumentParser(description='Simple obstacle avoiding behavior')
+    parser.add_argument('--onboard', action='store_true',
+                        help='run on the robot at BEHAVIOR_PERIOD, instead of from the base station')
+    cmd = parser.parse_args()
+
     supervisor = Supervisor(config)
 
-    with QBClient.connect(config.ROBOT_IP, config.BASE_IP, config.PORT) as qb:
+    if cmd.onboard:
+        from qb_server import QBServer
+
+        QBServer.run(config, supervisor)
+
+    else:
+        with QBClient.connect(config.ROBOT_IP, config.BASE_IP, config.PORT) as qb:
 
-        for _ in range(3000):
-            time.sleep(0.02)
+            # every cycle reads sensors once, and does not repeat unchanged motor commands
+            qb.enable_cache()
 
-            supervisor.execute(qb)
+            for _ in range(3000):
+                time.sleep(0.02)
+                qb.tick()
 
-            print qb.get_ir_distances()
+                supervisor.execute(qb)
+
+                print qb.get_ir_distances()
+
+            # stop motors
+            qb.set_speed(0, 0)
 
-        # stop motors
-        qb.set_speed(0, 0)
+            print 'Cache hits: %d, datagrams saved: %d' % (qb.cache_hits, qb.datagrams_saved)
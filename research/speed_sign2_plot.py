@@ -1,13 +1,12 @@
 import matplotlib.pyplot as plt
 
-data = []
-#with open('speed_sign2.csv') as f:
-with open('speed_sign2_carpet-2.csv') as f:
-	for line in f:
-		data.append(tuple(float(x) for x in line.strip().split(', ')))
+from tools import trace
 
-timer, speed_left, speed_right, ticks_left, ticks_right, torque_left, torque_right, torque = zip(*data)
-timer = [x / 120000 for x in timer]
+#filename = 'speed_sign2.qbt'
+filename = 'speed_sign2_carpet.qbt'
+
+timer, speed_left, speed_right, ticks_left, ticks_right, torque_left, torque_right, torque = trace.load(filename).columns()
+timer = timer / 120000.
 
 plt.plot(timer, speed_left, color='r', label='speed (left)')
 plt.plot(timer, speed_right, color='g', label='speed (right)')
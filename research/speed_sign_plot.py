@@ -1,12 +1,9 @@
 import matplotlib.pyplot as plt
 
-data = []
-with open('speed_sign.csv') as f:
-	for line in f:
-		data.append(tuple(float(x) for x in line.strip().split(', ')))
+from tools import trace
 
-timer, speed_left, speed_right, ticks_left, ticks_right, torque = zip(*data)
-timer = [x / 120000 for x in timer]
+timer, speed_left, speed_right, ticks_left, ticks_right, torque = trace.load('speed_sign.qbt').columns()
+timer = timer / 120000.
 
 plt.plot(timer, speed_left, color='r', label='speed (left)')
 plt.plot(timer, speed_right, color='g', label='speed (right)')
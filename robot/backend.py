@@ -0,0 +1,64 @@
+"""
+Hardware backends.
+
+Sensors and Motors do not talk to the hardware libraries directly. Instead they
+ask for a backend, which bundles everything that is robot-specific:
+
+    Capture - factory for ADC capture object (same interface as beaglebone_pru_adc.Capture)
+    GPIO    - GPIO module (same interface as Adafruit_BBIO.GPIO)
+    PWM     - PWM module (same interface as Adafruit_BBIO.PWM)
+    clock   - object with time() and sleep(seconds) methods
+
+Backend is selected by BACKEND parameter in config.py:
+
+    'bbb' - real QuickBot (BeagleBone Black). This is the default.
+    'sim' - simulated QuickBot, see robot/sim.py
+"""
+import time
+
+
+class Backend(object):
+
+    def __init__(self, name, Capture, GPIO, PWM, clock):
+        self.name = name
+        self.Capture = Capture
+        self.GPIO = GPIO
+        self.PWM = PWM
+        self.clock = clock
+
+
+_backends = {}  # id(config) -> (config, backend); config is kept alive so that its id is not reused
+
+
+def get_backend(config):
+    """
+    Returns backend selected by the config. Backend is created once per config, so that
+    Sensors and Motors share it (this matters for the simulator, where motors drive the
+    same simulated world that sensors observe).
+    """
+    entry = _backends.get(id(config))
+    if entry is None or entry[0] is not config:
+        entry = _backends[id(config)] = (config, _create_backend(config))
+    return entry[1]
+
+
+def _create_backend(config):
+    name = getattr(config, 'BACKEND', 'bbb')
+
+    if name == 'bbb':
+        import beaglebone_pru_adc as adc
+        import Adafruit_BBIO.GPIO as GPIO
+        import Adafruit_BBIO.PWM as PWM
+
+        return Backend(name, adc.Capture, GPIO, PWM, time)
+
+    elif name == 'sim':
+        from robot.sim import World
+
+        world = World(config)
+
+        backend = Backend(name, world.Capture, world.GPIO, world.PWM, world.clock)
+        backend.world = world
+        return backend
+
+    raise ValueError('Unknown backend: %r' % name)
@@ -0,0 +1,77 @@
+"""
+IR sensor calibration.
+
+Each sensor has its own (alpha, beta, gamma) coefficients of the rational model
+
+    d = (beta - gamma * v) / (v - alpha)
+
+(see tools/fit.py). At startup this model is evaluated for every possible ADC value and stored
+in a lookup table, so that converting a reading to distance is a single array index.
+
+Calibration file is JSON, as written by tools/fit.py:
+
+    {"sensors": [[alpha, beta, gamma], ...]}
+"""
+import json
+import os
+from array import array
+
+from tools.fit import distance
+
+
+ADC_MAX = 4095  # 12-bit ADC
+
+
+class IRCalibration(object):
+
+    def __init__(self, coefficients):
+        """
+        |coefficients| is a list of (alpha, beta, gamma) tuples, one per sensor.
+        """
+        self.coefficients = [tuple(c) for c in coefficients]
+        self.tables = [self.compile(*c) for c in self.coefficients]
+
+    @classmethod
+    def compile(cls, alpha, beta, gamma):
+        """
+        Returns lookup table of distances indexed by ADC value (truncated to integer, i.e. entry
+        i covers values from i to i+1 and is computed at i+0.5). Distances are clamped to 100 inches,
+        same as tools.fit.distance() does.
+        """
+        return array('d', [min(distance(alpha, beta, gamma, v + 0.5), 100) for v in range(ADC_MAX + 1)])
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as f:
+            data = json.load(f)
+        return cls(data['sensors'])
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Loads calibration from IR_CALIBRATION_FILE. If there is no such file, uses single
+        IR_CALIBRATION constant for all sensors (distance = IR_CALIBRATION / value).
+        """
+        filename = getattr(config, 'IR_CALIBRATION_FILE', None)
+        if filename:
+            if not os.path.isabs(filename):
+                filename = os.path.join(os.path.dirname(os.path.abspath(config.__file__)), filename)
+            if os.path.exists(filename):
+                return cls.load(filename)
+
+        return cls([(0., config.IR_CALIBRATION, 0.)] * len(config.IR_PINS))
+
+    def distances(self, values):
+        """Converts tuple of raw IR readings into a tuple of distances (inches)"""
+        # list and tuple come from CPython free lists, map() would allocate iterators on every call
+        return tuple(self.distances_into(values, [0.0] * len(self.tables)))
+
+    def distances_into(self, values, out):
+        """Same as distances(), but writes distances into |out| (list or array) without allocating"""
+        tables = self.tables
+        i = 0
+        count = len(tables)
+        while i < count:
+            out[i] = tables[i][int(values[i])]
+            i += 1
+        return out
@@ -3,12 +3,15 @@ Controller that stabilises wheel speed across all surfaces (carpet,
 hardwood, asphalt)
 """
 import argparse
-import time
 
 import config
+from robot.backend import get_backend
 from robot.sensors import Sensors
 from robot.motor import Motors
+from robot.odometry import Odometry
 from robot.pid import PID
+from robot import perf
+from robot.recorder import Recorder
 
 
 class BotController(object):
@@ -17,12 +20,21 @@ class BotController(object):
     of surface it is on (hard, carpet, asphalt).
 
     It also presents signed ticks and signed speed readings to the user,
-    courtesy of Helper class (see below).
+    courtesy of Helper class (see below), and integrates robot pose from them
+    (|odometry|, see robot/odometry.py).
 
-    This class expects that its on_timer() method is called at 100Hz frequency.
+    on_timer() is normally called at CONTROL_PERIOD (see config.py), but other rates work as well:
+    speed model and PID use time measured by the ADC timer (see Helper).
+
+    When recorder is enabled, every on_timer() call is recorded (see robot/recorder.py):
+
+        bot.recorder.enable()
+        ...
+        bot.recorder.export_csv('run.csv')
     """
 
     def __init__(self, config):
+        self.clock = get_backend(config).clock
         self._motors = Motors(config)
         self._sensors = Sensors(config)
 
@@ -38,10 +50,31 @@ class BotController(object):
         def right_ticks():
             return self._sensors.enc_ticks_right
 
+        def timer():
+            return self._sensors.timer
+
         self._left = Helper(speed_sensor=left_speed,
-                            ticks_sensor=left_ticks)
+                            ticks_sensor=left_ticks,
+                            timer_sensor=timer)
         self._right = Helper(speed_sensor=right_speed,
-                             ticks_sensor=right_ticks)
+                             ticks_sensor=right_ticks,
+                             timer_sensor=timer)
+
+        self.odometry = Odometry.from_config(config)
+
+        settings = getattr(config, 'RECORDER', {})
+        self.recorder = Recorder(settings.get('capacity', 30000))
+        if settings.get('enabled'):
+            self.recorder.enable()
+        # recorder columns, unpacked on the first recorded tick (see _bind_columns())
+        self._columns = None
+        self._ir_columns = None
+
+        # per-stage timing (see robot/perf.py), None if disabled
+        self.perf = perf.from_config(config)
+        if self.perf is not None:
+            self._stages = tuple(self.perf.stage(name) for name in (
+                'sensors', 'helper_left', 'helper_right', 'motors', 'odometry', 'record', 'tick'))
 
     def start(self):
         self._sensors.start()
@@ -51,12 +84,94 @@ class BotController(object):
         self._motors.close()
         self._sensors.stop()
 
-    def on_timer(self):
-        self._sensors.read()
+    def on_timer(self, ir=True):
+        """
+        Control tick: reads sensors, updates wheel speed control. If |ir| is False, IR sensors
+        are not read (when they are read at a lower rate with read_ir()).
+        """
+        if self.perf is not None:
+            return self._on_timer_timed(ir)
+
+        self._sensors.read(ir)
 
         self._left.on_timer()
         self._right.on_timer()
         self._motors.run(self._left.torque, self._right.torque)
+        self.odometry.update(self._left.ticks, self._right.ticks)
+
+        if self.recorder.enabled:
+            self._record()
+
+    def _on_timer_timed(self, ir):
+        """Same as on_timer(), but measures time of every stage"""
+        timer = self.perf.timer
+        sensors, helper_left, helper_right, motors, odometry, record, tick = self._stages
+
+        t0 = timer()
+        self._sensors.read(ir)
+        t1 = timer()
+        self._left.on_timer()
+        t2 = timer()
+        self._right.on_timer()
+        t3 = timer()
+        self._motors.run(self._left.torque, self._right.torque)
+        t4 = timer()
+        self.odometry.update(self._left.ticks, self._right.ticks)
+        t5 = timer()
+        if self.recorder.enabled:
+            self._record()
+        t6 = timer()
+
+        sensors.add(t1 - t0)
+        helper_left.add(t2 - t1)
+        helper_right.add(t3 - t2)
+        motors.add(t4 - t3)
+        odometry.add(t5 - t4)
+        record.add(t6 - t5)
+        tick.add(t6 - t0)
+
+    def _bind_columns(self):
+        """Unpacks recorder columns (allocated by recorder.enable()) once, so that recording does not allocate"""
+        first_ir = self.recorder.names.index('ir0')
+        self._columns = tuple(self.recorder.columns[:first_ir])
+        self._ir_columns = tuple(self.recorder.columns[first_ir:])
+
+    def _record(self):
+        if self._columns is None:
+            self._bind_columns()
+        sensors, left, right = self._sensors, self._left, self._right
+        (timer, raw_ticks_left, raw_ticks_right, ticks_left, ticks_right,
+         raw_speed_left, raw_speed_right, speed_left, speed_right,
+         reference_left, reference_right, computed_torque_left, computed_torque_right,
+         torque_left, torque_right) = self._columns
+
+        i = self.recorder.next_row()
+        timer[i] = sensors.timer
+        raw_ticks_left[i] = sensors.enc_ticks_left
+        raw_ticks_right[i] = sensors.enc_ticks_right
+        ticks_left[i] = left.ticks
+        ticks_right[i] = right.ticks
+        raw_speed_left[i] = sensors.speed_left
+        raw_speed_right[i] = sensors.speed_right
+        speed_left[i] = left.speed
+        speed_right[i] = right.speed
+        reference_left[i] = left.reference_speed
+        reference_right[i] = right.reference_speed
+        computed_torque_left[i] = left.computed_torque
+        computed_torque_right[i] = right.computed_torque
+        torque_left[i] = left.torque
+        torque_right[i] = right.torque
+
+        ir0, ir1, ir2, ir3, ir4 = self._ir_columns
+        values = sensors.values
+        ir0[i] = values[0]
+        ir1[i] = values[1]
+        ir2[i] = values[2]
+        ir3[i] = values[3]
+        ir4[i] = values[4]
+
+    def read_ir(self):
+        self._sensors.read_ir()
 
     def run(self, speed_left, speed_right):
         self._left.run(speed_left)
@@ -87,23 +202,46 @@ class Helper(object):
     Facades the real encoder values (unsigned) and presents to the user
     signed readings of ticks and speed.
 
-    This class expects that its on_timer() method is called at 100Hz frequency
-    (dynamical constants were fit using this assumption).
+    Dynamical constants and PID gains were fit at PERIOD between on_timer() calls (see tools/sysid.py).
+    If |timer_sensor| (ADC timer) is given, every step of the model and PID is scaled by the time
+    actually elapsed since previous call, so the same constants hold at any rate, and a late tick
+    does not skew the model. Without it, calls are assumed to be exactly PERIOD apart.
     """
 
-    DT = 0.05
+    DT = 0.05  # model step per PERIOD
+    GAIN = 1.0  # steady-state speed per unit of torque
     ALPHA = 1.0
 
+    PERIOD = 0.01  # nominal on_timer() period (seconds)
+    MAX_STEP = 10.0  # elapsed time is limited to that many periods (e.g. first tick after a stall)
+
+    __slots__ = ('_speed', '_ticks', '_timer', '_pid', 'dt', 'gain', 'alpha', 'torque', 'computed_torque',
+                 'reference_speed', '_direction', '_last_ticks', '_last_timer', '_logical_ticks',
+                 '_logical_speed', '_stopping', '_predicted_speed')
+
     def __init__(self,
                  speed_sensor,
                  ticks_sensor,
                  Kp=1.6,
                  Ki=0.2,
-                 integral_limit=300.0):
+                 integral_limit=300.0,
+                 dt=None,
+                 gain=None,
+                 alpha=None,
+                 timer_sensor=None):
+        """
+        |dt|, |gain| and |alpha| override model constants DT, GAIN and ALPHA for this instance.
+        """
         self._speed = speed_sensor
         self._ticks = ticks_sensor
+        self._timer = timer_sensor
+        self._last_timer = None
 
-        self._pid = PID(Kp, Ki, integral_limit=integral_limit)
+        self.dt = self.DT if dt is None else dt
+        self.gain = self.GAIN if gain is None else gain
+        self.alpha = self.ALPHA if alpha is None else alpha
+
+        self._pid = PID(Kp, Ki, integral_limit=integral_limit, period=self.PERIOD)
         self.torque = 0
         self.computed_torque = 0
         self.reference_speed = 0
@@ -118,9 +256,23 @@ class Helper(object):
     def run(self, speed):
         self.reference_speed = speed
 
-    def on_timer(self):
-        self.torque = self._pid(self.reference_speed - self._logical_speed)
-        self.computed_torque = self.torque
+    def on_timer(self, applied_torque=None):
+        """
+        Computes torque with PID. If |applied_torque| is given, it is what actually drives the
+        motor (and the speed model) instead of the computed torque - used to replay recorded
+        runs (see tools/replay.py).
+        """
+        elapsed = self.PERIOD
+        if self._timer is not None:
+            timer = self._timer()
+            if self._last_timer is not None:
+                elapsed = Sensors.elapsed(timer, self._last_timer)
+                if elapsed > self.MAX_STEP * self.PERIOD:
+                    elapsed = self.MAX_STEP * self.PERIOD
+            self._last_timer = timer
+
+        self.computed_torque = self._pid(self.reference_speed - self._logical_speed, elapsed)
+        self.torque = self.computed_torque if applied_torque is None else applied_torque
 
         ticks = self._ticks()
         speed = self._speed()
@@ -130,9 +282,9 @@ class Helper(object):
             return
 
         old_predicted_speed = self._predicted_speed
-        self._predicted_speed += self.DT * (
-            self.torque * self._direction
-            - self._predicted_speed + self.ALPHA * (speed - self._predicted_speed))
+        self._predicted_speed += self.dt * elapsed / self.PERIOD * (
+            self.gain * self.torque * self._direction
+            - self._predicted_speed + self.alpha * (speed - self._predicted_speed))
         if self._direction != 0 and (old_predicted_speed * self._predicted_speed < 0
                                      or 0 < self._predicted_speed < 1.0):
             # predicted speed changed sign
@@ -155,42 +307,43 @@ class Helper(object):
     def speed(self):
         return self._logical_speed
 
+    @property
+    def predicted_speed(self):
+        """Signed output of the speed model"""
+        return self._direction * self._predicted_speed
+
 
 if __name__ == '__main__':
 
     parser = argparse.ArgumentParser('Capture encoder ticks and speed response for step rotation input')
     parser.add_argument('speed', type=int, help='speed value in the range of 0-10')
-    parser.add_argument('filename', type=str, help='file name for writing CSV data')
+    parser.add_argument('filename', type=str, help='file name for writing data (CSV, or trace if it ends with .qbt)')
 
     cmd = parser.parse_args()
 
     bot = BotController(config)
+    bot.recorder.enable()
     bot.start()
 
-    data = []
-    reference_speed = 0
     for _ in range(400):
-        time.sleep(0.01)
+        bot.clock.sleep(0.01)
 
         bot.on_timer()
 
         if _ == 50:
-            reference_speed = cmd.speed
             bot.run(cmd.speed, cmd.speed)
 
         if _ == 200:
-            reference_speed = -cmd.speed
             bot.run(-cmd.speed, -cmd.speed)
 
         if _ == 350:
-            reference_speed = 0
             bot.run(0, 0)
 
-        data.append( (bot.timer, reference_speed, bot.actual_speed[0], bot.actual_speed[1],
-            bot._left.computed_torque, bot._right.computed_torque, bot._left.torque, bot._right.torque) )
-
-    with open(cmd.filename, 'w') as f:
-        for datum in data:
-            f.write(', '.join(str(x) for x in datum) + '\n')
+    columns = ('timer', 'reference_left', 'speed_left', 'speed_right',
+               'computed_torque_left', 'computed_torque_right', 'torque_left', 'torque_right')
+    if cmd.filename.endswith('.qbt'):
+        bot.recorder.export_trace(cmd.filename, columns, 'controller')
+    else:
+        bot.recorder.export_csv(cmd.filename, columns)
 
     print 'Data written to', cmd.filename
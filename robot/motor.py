@@ -1,35 +1,53 @@
-import Adafruit_BBIO.GPIO as GPIO
-import Adafruit_BBIO.PWM as PWM
+from robot.backend import get_backend
 
 
-class Motor:
+class Motor(object):
     """
     Helper class that controls one motor speed
+
+    Every pin write is a system call, so Motor remembers what was last written and only
+    touches direction pins when direction changes, and PWM when duty cycle moved by at
+    least |resolution|. Counters |writes| and |elided| track how many pin writes were
+    done and saved.
     """
 
-    def __init__(self, pwm_pin, dir1_pin, dir2_pin, max_speed=100):
-        """
+    __slots__ = ('speed', 'max_speed', 'resolution', 'writes', 'elided', '_pwm_pin', '_dir1_pin',
+                 '_dir2_pin', '_GPIO', '_PWM', '_direction', '_duty')
 
+    def __init__(self, pwm_pin, dir1_pin, dir2_pin, backend, max_speed=100, resolution=0.0):
+        """
+        |backend| provides GPIO and PWM modules (see robot/backend.py)
+        |resolution| smallest duty cycle change that is written to PWM (zero means "any change")
         """
         self.speed = 0
         self.max_speed = max_speed
+        self.resolution = resolution
+
+        self.writes = 0
+        self.elided = 0
 
         self._pwm_pin = pwm_pin
         self._dir1_pin = dir1_pin
         self._dir2_pin = dir2_pin
 
-        GPIO.setup(self._dir1_pin, GPIO.OUT)
-        GPIO.setup(self._dir2_pin, GPIO.OUT)
-        PWM.start(self._pwm_pin, 0)
-        PWM.set_duty_cycle(self._pwm_pin, 0)
+        self._GPIO = backend.GPIO
+        self._PWM = backend.PWM
+
+        self._GPIO.setup(self._dir1_pin, self._GPIO.OUT)
+        self._GPIO.setup(self._dir2_pin, self._GPIO.OUT)
+        self._PWM.start(self._pwm_pin, 0)
+        self._PWM.set_duty_cycle(self._pwm_pin, 0)
+
+        self._direction = None  # unknown until first run()
+        self._duty = 0
 
     def close(self):
-        PWM.set_duty_cycle(self._pwm_pin, 0)
+        self._PWM.set_duty_cycle(self._pwm_pin, 0)
+        self._duty = 0
 
-    @classmethod
-    def cleanup(cls):
-        PWM.cleanup()
-        GPIO.cleanup()
+    def cleanup(self):
+        self._PWM.cleanup()
+        self._GPIO.cleanup()
 
     def run(self, speed):
         """
@@ -42,36 +60,68 @@ class Motor:
             100.0 means "run forward at full speed"
             -100.0 means "run backward at full speed"
         """
-        self.speed = min(max(speed, -self.max_speed), self.max_speed)
+        if speed > self.max_speed:
+            speed = self.max_speed
+        elif speed < -self.max_speed:
+            speed = -self.max_speed
+        self.speed = speed
+
+        GPIO = self._GPIO
 
         if self.speed > 0:
-            GPIO.output(self._dir1_pin, GPIO.LOW)
-            GPIO.output(self._dir2_pin, GPIO.HIGH)
-            PWM.set_duty_cycle(self._pwm_pin, abs(self.speed))
+            direction = 1
         elif self.speed < 0:
-            GPIO.output(self._dir1_pin, GPIO.HIGH)
-            GPIO.output(self._dir2_pin, GPIO.LOW)
-            PWM.set_duty_cycle(self._pwm_pin, abs(self.speed))
+            direction = -1
         else:
-            GPIO.output(self._dir1_pin, GPIO.LOW)
-            GPIO.output(self._dir2_pin, GPIO.LOW)
-            PWM.set_duty_cycle(self._pwm_pin, 0)
+            direction = 0
+
+        if direction != self._direction:
+            if direction > 0:
+                GPIO.output(self._dir1_pin, GPIO.LOW)
+                GPIO.output(self._dir2_pin, GPIO.HIGH)
+            elif direction < 0:
+                GPIO.output(self._dir1_pin, GPIO.HIGH)
+                GPIO.output(self._dir2_pin, GPIO.LOW)
+            else:
+                GPIO.output(self._dir1_pin, GPIO.LOW)
+                GPIO.output(self._dir2_pin, GPIO.LOW)
+            self._direction = direction
+            self.writes += 2
+        else:
+            self.elided += 2
+
+        duty = abs(self.speed)
+        if duty != self._duty and (duty == 0 or abs(duty - self._duty) >= self.resolution):
+            self._PWM.set_duty_cycle(self._pwm_pin, duty)
+            self._duty = duty
+            self.writes += 1
+        else:
+            self.elided += 1
+
 
+class Motors(object):
 
-class Motors:
+    __slots__ = ('_motor_left', '_motor_right')
 
     def __init__(self, config):
 
+        backend = get_backend(config)
+        resolution = getattr(config, 'MOTOR_DUTY_RESOLUTION', 0.0)
+
         self._motor_left = Motor(
             config.MOTOR_LEFT['pwm'],
             config.MOTOR_LEFT['dir1'],
-            config.MOTOR_LEFT['dir2']
+            config.MOTOR_LEFT['dir2'],
+            backend,
+            resolution=resolution
         )
 
         self._motor_right = Motor(
             config.MOTOR_RIGHT['pwm'],
             config.MOTOR_RIGHT['dir1'],
-            config.MOTOR_RIGHT['dir2']
+            config.MOTOR_RIGHT['dir2'],
+            backend,
+            resolution=resolution
         )
 
     def run(self, speed_left, speed_right):
@@ -82,4 +132,14 @@ class Motors:
     def close(self):
         self._motor_left.close()
         self._motor_right.close()
-        Motor.cleanup()
\ No newline at end of file
+        self._motor_left.cleanup()
+
+    @property
+    def writes(self):
+        """Number of pin writes done by both motors"""
+        return self._motor_left.writes + self._motor_right.writes
+
+    @property
+    def elided(self):
+        """Number of pin writes skipped because pin already had the right value"""
+        return self._motor_left.elided + self._motor_right.elided
\ No newline at end of file
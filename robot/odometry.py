@@ -0,0 +1,79 @@
+"""
+Dead reckoning of the robot pose from signed wheel encoder ticks
+"""
+import math
+
+
+class Odometry(object):
+    """
+    Integrates pose (x, y in inches, theta in radians, counter-clockwise from the x axis) of
+    a differential drive robot. update() is called every control tick with the signed ticks
+    of both wheels (see robot/controller.py Helper); each wheel's travel since the previous
+    call is applied as an arc (midpoint heading), which is exact for constant wheel speeds.
+
+    update() does not allocate memory, so it is cheap enough to run in the control tick.
+
+    Example:
+
+        odometry = Odometry(wheel_radius=1.3, wheel_base=3.7, ticks_per_rev=16)
+        odometry.update(ticks_left, ticks_right)
+        x, y, theta = odometry.pose
+    """
+
+    __slots__ = ('x', 'y', 'theta', 'inches_per_tick', 'wheel_base', '_last_left', '_last_right')
+
+    def __init__(self, wheel_radius, wheel_base, ticks_per_rev):
+        self.inches_per_tick = 2 * math.pi * wheel_radius / ticks_per_rev
+        self.wheel_base = float(wheel_base)
+        self.x = 0.0
+        self.y = 0.0
+        self.theta = 0.0
+        self._last_left = None
+        self._last_right = None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.WHEEL_RADIUS, config.WHEEL_BASE, config.TICKS_PER_REV)
+
+    @property
+    def pose(self):
+        return self.x, self.y, self.theta
+
+    def set_pose(self, x, y, theta):
+        """Sets current pose; following updates integrate from here"""
+        self.x = float(x)
+        self.y = float(y)
+        self.theta = math.atan2(math.sin(theta), math.cos(theta))
+
+    def reset(self):
+        self.set_pose(0.0, 0.0, 0.0)
+
+    def update(self, ticks_left, ticks_right):
+        """Integrates wheel travel since the previous call"""
+        if self._last_left is None:
+            self._last_left = ticks_left
+            self._last_right = ticks_right
+            return
+
+        delta_left = ticks_left - self._last_left
+        delta_right = ticks_right - self._last_right
+        if delta_left == 0 and delta_right == 0:
+            return
+        self._last_left = ticks_left
+        self._last_right = ticks_right
+
+        left = delta_left * self.inches_per_tick
+        right = delta_right * self.inches_per_tick
+        distance = 0.5 * (left + right)
+        rotation = (right - left) / self.wheel_base
+
+        heading = self.theta + 0.5 * rotation
+        self.x += distance * math.cos(heading)
+        self.y += distance * math.sin(heading)
+
+        theta = self.theta + rotation
+        if theta > math.pi:
+            theta -= 2 * math.pi
+        elif theta < -math.pi:
+            theta += 2 * math.pi
+        self.theta = theta
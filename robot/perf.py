@@ -0,0 +1,80 @@
+"""
+Per-stage timing of the control tick.
+
+Each stage has a fixed-bucket Histogram (see robot/stats.py), so timing a stage does not
+allocate memory. Enabled with PERF_ENABLED in config.py, queried remotely with $PERF?* command.
+
+TIMER is not monotonic on Python 2 (it is the wall clock, which NTP may step), so a stage timed
+across a clock step comes out negative or far too long. Stage histograms drop such samples
+(negative, or longer than MAX_SAMPLE) and count them as |dropped|.
+
+Example:
+
+    perf = Perf()
+    sensors = perf.stage('sensors')
+
+    t0 = perf.timer()
+    read_sensors()
+    sensors.add(perf.timer() - t0)
+
+    print perf.summary()
+"""
+import time
+
+from robot.stats import Histogram
+
+
+# python 3.3+ has monotonic clock, python 2 falls back to wall time
+TIMER = getattr(time, 'monotonic', time.time)
+
+# 1us to 100ms, 5% resolution
+BOUNDS = Histogram.log_bounds(1e-6, 0.1, per_decade=48)
+
+MAX_SAMPLE = 1.0  # seconds, no stage takes that long unless the clock stepped
+
+
+class StageHistogram(Histogram):
+    """Histogram of stage durations that drops samples spoiled by a clock step"""
+
+    def reset(self):
+        Histogram.reset(self)
+        self.dropped = 0
+
+    def add(self, x):
+        """Adds sample |x| (seconds) unless it is negative or above MAX_SAMPLE. Returns True if added."""
+        if x < 0 or x > MAX_SAMPLE:
+            self.dropped += 1
+            return False
+        Histogram.add(self, x)
+        return True
+
+
+class Perf(object):
+
+    def __init__(self, timer=TIMER):
+        self.timer = timer
+        self.names = []
+        self._stages = {}
+
+    def stage(self, name):
+        """Returns histogram of stage |name| (creating it on first use)"""
+        histogram = self._stages.get(name)
+        if histogram is None:
+            histogram = self._stages[name] = StageHistogram(BOUNDS)
+            self.names.append(name)
+        return histogram
+
+    def reset(self):
+        for histogram in self._stages.values():
+            histogram.reset()
+
+    def summary(self):
+        """Returns list of (stage name, Histogram.summary()), in the order stages were created"""
+        return [(name, self._stages[name].summary()) for name in self.names]
+
+
+def from_config(config):
+    """Returns Perf instance if PERF_ENABLED is set in config, None otherwise"""
+    if getattr(config, 'PERF_ENABLED', False):
+        return Perf()
+    return None
@@ -3,7 +3,7 @@ PID controller
 """
 
 
-class PID:
+class PID(object):
     """
     Classical PID controller.
 
@@ -13,9 +13,17 @@ class PID:
 
         for input in read_input():
             output = pid(input)
+
+    If calls are not evenly spaced, create it with the |period| gains were tuned at and pass the
+    actual time since previous call:
+
+        pid = PID(Kp=1.0, Ki=0.1, period=0.01)
+        output = pid(input, dt=0.013)
     """
 
-    def __init__(self, Kp, Ki=0, Kd=0, x0=0, integral_limit=10.0):
+    __slots__ = ('Kp', 'Ki', 'Kd', 'period', '_x_prev', '_acc', '_integral_limit')
+
+    def __init__(self, Kp, Ki=0, Kd=0, x0=0, integral_limit=10.0, period=None):
         """
         Creates an instance of PID controller.
 
@@ -30,17 +38,31 @@ class PID:
                     to contribute as much as twice the proportional term. Value of zero
                     effectively turns off integral and derivative terms. Large value does not
                     impose any limits, resulting in an ordinary PID behavior.
+            period - nominal time between calls (seconds) gains were tuned at. If set, integral
+                    and derivative terms are scaled by the |dt| passed to each call.
         """
         self.Kp = Kp
         self.Ki = Ki
         self.Kd = Kd
+        self.period = period
 
         self._x_prev = x0
         self._acc = 0
         self._integral_limit = integral_limit
 
-    def __call__(self, x):
-        self._acc += x
+    def __call__(self, x, dt=None):
+        """
+        Returns controller output for input |x|. |dt| is time since previous call (seconds),
+        ignored unless PID was created with |period|.
+        """
+        delta = x - self._x_prev
+        if dt is None or self.period is None:
+            self._acc += x
+        else:
+            # integral grows with elapsed time, derivative is change per nominal period
+            step = dt / self.period
+            self._acc += x * step
+            delta = delta / step if step > 0 else 0.0
 
         # anti-saturation logic: do not allow integral contribution
         # to exceed gain limit
@@ -50,7 +72,7 @@ class PID:
             self._acc = -self._integral_limit
 
         # integral and derivative PID terms
-        out = self.Kp * x + self.Ki * self._acc + self.Kd * (x - self._x_prev)
+        out = self.Kp * x + self.Ki * self._acc + self.Kd * delta
         self._x_prev = x
 
         return out
@@ -0,0 +1,115 @@
+"""
+Fixed-capacity telemetry recorder.
+
+Data is kept in preallocated columns (one array per value), used as a ring buffer: when recorder
+is full, oldest rows are overwritten. Recording a row does not allocate memory. Columns are allocated
+when the recorder is first enabled, so a recorder that is never used costs no memory.
+"""
+from array import array
+
+from tools import trace
+
+
+# (name, typecode) of each column, as recorded by BotController. Timer and raw encoder ticks are unsigned
+# 32-bit PRU counters ('L'): a signed 'l' is only 32 bits on the BeagleBone and overflows after 2**31.
+COLUMNS = (
+    ('timer', 'L'),
+    ('raw_ticks_left', 'L'),
+    ('raw_ticks_right', 'L'),
+    ('ticks_left', 'l'),
+    ('ticks_right', 'l'),
+    ('raw_speed_left', 'd'),
+    ('raw_speed_right', 'd'),
+    ('speed_left', 'd'),
+    ('speed_right', 'd'),
+    ('reference_left', 'd'),
+    ('reference_right', 'd'),
+    ('computed_torque_left', 'd'),
+    ('computed_torque_right', 'd'),
+    ('torque_left', 'd'),
+    ('torque_right', 'd'),
+    ('ir0', 'd'),
+    ('ir1', 'd'),
+    ('ir2', 'd'),
+    ('ir3', 'd'),
+    ('ir4', 'd'),
+)
+
+
+class Recorder(object):
+    """
+    Example:
+
+        recorder = Recorder(1000)
+        recorder.enable()
+        ...
+        i = recorder.next_row()
+        recorder.columns[0][i] = timer
+        ...
+        data = recorder.snapshot()
+    """
+
+    def __init__(self, capacity, columns=COLUMNS):
+        self.capacity = capacity
+        self.names = tuple(name for name, _ in columns)
+        self.typecodes = tuple(typecode for _, typecode in columns)
+        self.kinds = dict((name, trace.INT if typecode in 'lL' else trace.FLOAT) for name, typecode in columns)
+        self.columns = None  # list of arrays, allocated by enable()
+        self.enabled = False
+        self.clear()
+
+    def enable(self):
+        if self.columns is None:
+            self.columns = [array(typecode, [0]) * self.capacity for typecode in self.typecodes]
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self._next = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def next_row(self):
+        """
+        Returns index of the row to write (overwriting the oldest one if recorder is full)
+        """
+        i = self._next
+        self._next = i + 1 if i + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+        return i
+
+    def column(self, name):
+        """Returns copy of the named column, oldest row first"""
+        index = self.names.index(name)
+        if self.columns is None:
+            return array(self.typecodes[index])
+        col = self.columns[index]
+        if self.count < self.capacity:
+            return col[:self.count]
+        return col[self._next:] + col[:self._next]
+
+    def snapshot(self, names=None):
+        """Returns dictionary name -> array of recorded values, oldest row first"""
+        return dict((name, self.column(name)) for name in (names or self.names))
+
+    def export_csv(self, filename, names=None):
+        """
+        Writes recorded rows to a CSV file (no header). |names| selects and orders columns
+        (by default - all columns).
+        """
+        names = names or self.names
+        data = [self.column(name) for name in names]
+        with open(filename, 'w') as f:
+            for row in zip(*data):
+                f.write(', '.join(str(x) for x in row) + '\n')
+
+    def export_trace(self, filename, names=None, schema_name='recorder'):
+        """Writes recorded rows to a trace file (see tools/trace.py)"""
+        names = names or self.names
+        trace.write(filename, [(name, self.kinds[name]) for name in names],
+                    [self.column(name) for name in names], schema_name)
@@ -0,0 +1,294 @@
+"""
+Drift-free periodic scheduling for the control loop
+"""
+import time
+
+from robot import perf
+from robot.stats import Histogram
+
+
+class PeriodicScheduler(object):
+    """
+    Runs a loop at a fixed rate. Deadlines are absolute (start + n * period), so the time spent
+    doing work between ticks does not accumulate into the period.
+
+    When loop falls behind (work took longer than the period), the policy decides what happens
+    to the missed ticks:
+
+        SKIP     - missed ticks are dropped, next tick is aligned to the period grid
+        CATCH_UP - missed ticks are executed back-to-back (at most |max_catch_up| of them),
+                   so that the number of ticks matches the elapsed time
+
+    Example:
+
+        scheduler = PeriodicScheduler(0.01)
+        while True:
+            scheduler.wait()
+            do_work()
+
+    If loop needs to do something else while waiting (e.g. serve the network), use
+    time_to_deadline() and tick() instead of wait().
+
+    Clock is the wall clock (Python 2.7 has no monotonic one), and NTP may step it. When it steps
+    backwards (the next deadline is more than two periods away, or now is before the last tick), the
+    schedule is re-started, so the loop does not sleep for the size of the step. Such restarts are
+    counted as |clock_jumps|. Forward steps are handled as missed ticks by the policy.
+    """
+
+    SKIP = 'skip'
+    CATCH_UP = 'catch_up'
+
+    def __init__(self, period, policy=SKIP, clock=time, max_catch_up=10):
+        if policy not in (self.SKIP, self.CATCH_UP):
+            raise ValueError('Unknown scheduling policy: %r' % policy)
+
+        self.period = period
+        self.policy = policy
+        self.max_catch_up = max_catch_up
+        self._clock = clock
+
+        self._deadline = None
+        self._last_tick = None
+
+        self.ticks = 0
+        self.overruns = 0  # ticks that started later than one period after their deadline
+        self.skipped = 0  # ticks dropped by SKIP policy (or beyond max_catch_up)
+        self.clock_jumps = 0  # schedule restarts after the clock stepped backwards
+
+        self.period_histogram = Histogram(Histogram.linear_bounds(0.0, 4 * period, 81))
+        self.jitter_histogram = Histogram(Histogram.log_bounds(1e-6, 10 * period))
+
+    def start(self):
+        """(Re-)starts the schedule. First tick is due immediately."""
+        self._deadline = self._clock.time()
+        self._last_tick = None
+
+    def _check_clock(self, now):
+        """Re-starts the schedule if clock stepped backwards since the last tick"""
+        if self._deadline - now > 2 * self.period or (self._last_tick is not None and now < self._last_tick):
+            self.clock_jumps += 1
+            self._deadline = now
+            self._last_tick = None
+
+    def time_to_deadline(self):
+        """Returns time left until the next tick is due (negative if tick is late)"""
+        if self._deadline is None:
+            self.start()
+        now = self._clock.time()
+        self._check_clock(now)
+        return self._deadline - now
+
+    def wait(self):
+        """Sleeps until the next tick is due, then marks the tick."""
+        remaining = self.time_to_deadline()
+        if remaining > 0:
+            self._clock.sleep(remaining)
+        self.tick()
+
+    def tick(self):
+        """
+        Marks the start of a tick and computes the next deadline. Call this when
+        time_to_deadline() is no longer positive.
+        """
+        if self._deadline is None:
+            self.start()
+
+        now = self._clock.time()
+        self._check_clock(now)
+        lateness = now - self._deadline
+
+        self.ticks += 1
+        self.jitter_histogram.add(max(lateness, 0.0))
+        if self._last_tick is not None:
+            self.period_histogram.add(now - self._last_tick)
+        self._last_tick = now
+
+        missed = int(lateness / self.period) if lateness > 0 else 0
+        if missed > 0:
+            self.overruns += 1
+
+        if missed > 0 and (self.policy == self.SKIP or missed > self.max_catch_up):
+            # re-align with the period grid, dropping missed ticks
+            self.skipped += missed
+            self._deadline += (missed + 1) * self.period
+        else:
+            self._deadline += self.period
+
+    def stats(self):
+        """Returns scheduling statistics as a dictionary"""
+        return {
+            'ticks': self.ticks,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'clock_jumps': self.clock_jumps,
+            'period': self.period_histogram.summary(),
+            'jitter': self.jitter_histogram.summary(),
+        }
+
+
+class Task(object):
+    """
+    Periodic task of MultiRateScheduler. Keeps its own schedule (see PeriodicScheduler) and time
+    spent running.
+    """
+
+    def __init__(self, name, func, period, priority, policy, clock):
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.schedule = PeriodicScheduler(period, policy, clock)
+        self.busy = 0.0  # seconds spent in func
+        self.run_histogram = perf.StageHistogram(perf.BOUNDS)
+
+    @property
+    def period(self):
+        return self.schedule.period
+
+    def stats(self, elapsed):
+        """Returns scheduling statistics of the task; |elapsed| is time since scheduler start"""
+        stats = self.schedule.stats()
+        stats['priority'] = self.priority
+        stats['rate'] = 1.0 / self.period
+        stats['cpu'] = self.busy / elapsed if elapsed > 0 else 0.0
+        stats['run'] = self.run_histogram.summary()
+        return stats
+
+
+class MultiRateScheduler(object):
+    """
+    Runs several periodic tasks from one thread, each at its own rate. When several tasks are due,
+    they run in priority order (lower number first), and after each one the scheduler looks for due
+    tasks again, so a slow low-priority task delays a high-priority one by at most one run.
+
+    Each task keeps the deadline logic of PeriodicScheduler (|policy| decides what happens to missed
+    runs, and a backward clock step re-starts the task's schedule). Time spent in every task is
+    measured, stats() reports it as fraction of the elapsed time.
+
+    Example:
+
+        scheduler = MultiRateScheduler()
+        scheduler.add('control', bot.on_timer, 0.005)
+        scheduler.add('behavior', behavior, 0.05, priority=2)
+        while True:
+            scheduler.wait()
+
+    If loop needs to do something else while waiting (e.g. serve the network), use
+    time_to_deadline() and run_pending() instead of wait().
+    """
+
+    def __init__(self, policy=PeriodicScheduler.SKIP, clock=time, timer=perf.TIMER):
+        self.policy = policy
+        self._clock = clock
+        self._timer = timer
+        self.tasks = []  # sorted by priority
+        self._started = None
+
+    def add(self, name, func, period, priority=0):
+        """Adds task |name| that calls func() every |period| seconds. Returns Task."""
+        if self.task(name) is not None:
+            raise ValueError('Task %r already exists' % name)
+        task = Task(name, func, period, priority, self.policy, self._clock)
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: t.priority)
+        if self._started is not None:
+            task.schedule.start()
+        return task
+
+    def task(self, name):
+        """Returns Task |name|, or None"""
+        for task in self.tasks:
+            if task.name == name:
+                return task
+        return None
+
+    def start(self):
+        """(Re-)starts all tasks. All of them are due immediately."""
+        for task in self.tasks:
+            task.schedule.start()
+        self._started = self._timer()
+
+    def time_to_deadline(self):
+        """Returns time left until the next task is due (negative if it is late)"""
+        if self._started is None:
+            self.start()
+        return min(task.schedule.time_to_deadline() for task in self.tasks)
+
+    def run_pending(self):
+        """Runs tasks that are due, highest priority first. Returns number of runs."""
+        if self._started is None:
+            self.start()
+
+        timer = self._timer
+        runs = 0
+        while True:
+            for task in self.tasks:
+                if task.schedule.time_to_deadline() <= 0:
+                    break
+            else:
+                return runs
+
+            task.schedule.tick()
+            t0 = timer()
+            task.func()
+            spent = timer() - t0
+            if task.run_histogram.add(spent):  # not if the clock stepped meanwhile
+                task.busy += spent
+            runs += 1
+
+    def wait(self):
+        """Sleeps until the next task is due, then runs all due tasks"""
+        remaining = self.time_to_deadline()
+        if remaining > 0:
+            self._clock.sleep(remaining)
+        self.run_pending()
+
+    def stats(self):
+        """Returns list of (task name, statistics dictionary), in priority order"""
+        elapsed = self._timer() - self._started if self._started is not None else 0.0
+        return [(task.name, task.stats(elapsed)) for task in self.tasks]
+
+
+if __name__ == '__main__':
+    # self-check: schedule survives the wall clock stepping backwards (as NTP does on the BeagleBone)
+
+    class StepClock(object):
+        def __init__(self):
+            self.now = 1000.0
+
+        def time(self):
+            return self.now
+
+        def sleep(self, seconds):
+            assert seconds <= 0.01 + 1e-9, 'slept %.3f s' % seconds
+            self.now += seconds
+
+    clock = StepClock()
+    scheduler = PeriodicScheduler(0.01, clock=clock)
+    for _ in range(10):
+        scheduler.wait()
+    clock.now -= 3600
+    assert scheduler.time_to_deadline() <= 0.01, scheduler.time_to_deadline()
+    for _ in range(10):
+        scheduler.wait()
+    clock.now -= 0.005  # less than a period: caught as now before the last tick
+    for _ in range(10):
+        scheduler.wait()
+    assert scheduler.clock_jumps == 2 and scheduler.ticks == 30, scheduler.stats()
+    print 'PeriodicScheduler: ok'
+
+    # every task of MultiRateScheduler re-starts its own schedule, so control keeps running
+    clock = StepClock()
+    runs = {'control': 0, 'ir': 0}
+    scheduler = MultiRateScheduler(clock=clock, timer=clock.time)
+    scheduler.add('control', lambda: runs.__setitem__('control', runs['control'] + 1), 0.005)
+    scheduler.add('ir', lambda: runs.__setitem__('ir', runs['ir'] + 1), 0.01, priority=1)
+    for _ in range(20):
+        scheduler.wait()
+    before = dict(runs)
+    clock.now -= 3600
+    assert scheduler.time_to_deadline() <= 0.01, scheduler.time_to_deadline()
+    for _ in range(20):
+        scheduler.wait()
+    assert runs['control'] - before['control'] >= 15 and runs['ir'] > before['ir'], runs
+    assert all(stats['clock_jumps'] == 1 for _, stats in scheduler.stats()), scheduler.stats()
+    print 'MultiRateScheduler: ok'
@@ -3,22 +3,33 @@ QuickBot sensors.
 
 Presently all sensors are based on internal ADC
 """
+from robot.backend import get_backend
 
-import beaglebone_pru_adc as adc
 
-
-class Sensors:
+class Sensors(object):
     """
     Represents raw QuickBot sensors. "Raw" means that ticks and speed are unsigned, as read
     from the hardware.
+
+    read() does not allocate memory: |values| is a list, updated in place (do not modify it,
+    copy it if you need to keep values of a particular tick).
     """
 
+    __slots__ = ('_adc', '_ir_pins', '_scale', 'timer', 'speed_left', 'speed_right',
+                 'enc_ticks_left', 'enc_ticks_right', 'values')
+
     TIMERTICKS_PER_SEC = 121000.0  # that many timer ticks per second
+    TIMER_MODULUS = 2**32  # PRU timer is a 32-bit counter, wraps around
+
+    @classmethod
+    def elapsed(cls, timer, previous):
+        """Returns seconds between two timer readings (handles timer wrap around)"""
+        return ((timer - previous) % cls.TIMER_MODULUS) / cls.TIMERTICKS_PER_SEC
 
     def __init__(self, config):
 
         # Initialize ADC
-        self._adc = adc.Capture()
+        self._adc = get_backend(config).Capture()
         self._adc.encoder0_pin = config.MOTOR_LEFT['encoder_pin']
         self._adc.encoder1_pin = config.MOTOR_RIGHT['encoder_pin']
         self._adc.encoder0_threshold = config.MOTOR_LEFT['encoder_threshold']
@@ -27,15 +38,15 @@ class Sensors:
         self._adc.encoder1_delay = config.MOTOR_RIGHT['encoder_delay']
         self._adc.ema_pow = config.EMA_POW
 
-        self._ir_pins = config.IR_PINS
-        self._scale = 2**config.EMA_POW
+        self._ir_pins = tuple(config.IR_PINS)
+        self._scale = float(2**config.EMA_POW)
 
         self.timer = 0
         self.speed_left = 0
         self.speed_right = 0
         self.enc_ticks_left = 0
         self.enc_ticks_right = 0
-        self.values = tuple([0] * len(self._ir_pins))
+        self.values = [0.0] * len(self._ir_pins)
 
     def start(self):
         self._adc.start()
@@ -43,7 +54,8 @@ class Sensors:
     def stop(self):
         self._adc.stop()
 
-    def read(self):
+    def read(self, ir=True):
+        """Reads timer and encoders, and IR sensors unless |ir| is False (see read_ir())"""
         self.timer = self._adc.timer
         self.enc_ticks_left = self._adc.encoder0_ticks
         self.enc_ticks_right = self._adc.encoder1_ticks
@@ -53,5 +65,16 @@ class Sensors:
         self.speed_left = self.TIMERTICKS_PER_SEC / (self._adc.encoder0_speed + 1.0)
         self.speed_right = self.TIMERTICKS_PER_SEC / (self._adc.encoder1_speed + 1.0)
 
-        values = self._adc.values
-        self.values = tuple(float(values[x])/self._scale for x in self._ir_pins)
+        if ir:
+            self.read_ir()
+
+    def read_ir(self):
+        adc_values = self._adc.values
+        pins = self._ir_pins
+        values = self.values
+        scale = self._scale
+        i = 0
+        count = len(values)
+        while i < count:  # no iterator objects
+            values[i] = adc_values[pins[i]] / scale
+            i += 1
@@ -0,0 +1,423 @@
+"""
+Simulated QuickBot.
+
+Emulates hardware that QuickBot software talks to: PRU ADC capture (timer, encoder ticks,
+inverse encoder speed, and IR sensor readings), GPIO pins and PWM outputs driving
+the motors. World state is a differential drive robot in a 2D arena made of wall segments.
+
+All units are inches, seconds, and radians. Wheel speed is in encoder ticks per second.
+
+Simulation is driven by the clock. In real-time mode clock follows the wall time. Otherwise
+clock only advances when someone calls clock.sleep(), which returns immediately. This lets
+the whole stack (BotController, QB, behaviors) run as fast as CPU allows.
+
+To use, set in config.py:
+
+    BACKEND = 'sim'
+"""
+import math
+import random
+import time
+
+from robot.sensors import Sensors
+
+
+DEFAULTS = {
+    'realtime': True,  # if False, simulated time advances only when clock.sleep() is called
+    'step': 0.002,  # integration step (seconds)
+    'seed': None,  # random seed for IR noise
+
+    # arena: list of wall segments ((x0, y0), (x1, y1)), inches
+    'arena': [
+        ((-60., -60.), (60., -60.)),
+        ((60., -60.), (60., 60.)),
+        ((60., 60.), (-60., 60.)),
+        ((-60., 60.), (-60., -60.)),
+    ],
+    'start_pose': (0., 0., 0.),  # x, y, theta
+
+    # robot geometry. Parameters that also exist in config.py (see FROM_CONFIG) default to those values,
+    # so that odometry and mapping match the simulated robot.
+    'wheel_radius': 1.3,
+    'wheel_base': 3.7,  # distance between wheels
+    'ticks_per_rev': 16,
+    'body_radius': 2.5,
+
+    # motor dynamics: wheel speed follows gain * (duty - deadband) with time constant tau
+    'tau': 0.2,
+    'gain': 1.3,
+    'deadband': 10.0,
+
+    # IR sensors, in the same order as IR_PINS
+    'ir_angles': (math.pi / 2, math.pi / 4, 0., -math.pi / 4, -math.pi / 2),
+    'ir_offset': 2.5,  # distance of sensors from robot center (on the body perimeter)
+    'ir_range': 32.0,  # sensor does not see further than that
+    'ir_model': (0., 5555.5, 0.),  # alpha, beta, gamma: V = (alpha * d + beta) / (d + gamma), see tools/fit.py
+    'ir_noise': 0.0,  # standard deviation of IR reading noise (ADC units)
+}
+
+# simulator parameter -> config.py setting it defaults to
+FROM_CONFIG = {
+    'wheel_radius': 'WHEEL_RADIUS',
+    'wheel_base': 'WHEEL_BASE',
+    'ticks_per_rev': 'TICKS_PER_REV',
+    'ir_angles': 'IR_ANGLES',
+    'ir_offset': 'IR_OFFSET',
+    'ir_range': 'IR_RANGE',
+}
+
+ENCODER_SPEED_IDLE = 0x7fffffff  # inverse speed reported before the first tick
+
+
+class Clock(object):
+    """
+    Simulated clock. Has the same time()/sleep() interface as the time module.
+    """
+
+    def __init__(self, realtime=True):
+        self.realtime = realtime
+        self._now = time.time()
+
+    def time(self):
+        if self.realtime:
+            return time.time()
+        return self._now
+
+    def sleep(self, seconds):
+        if self.realtime:
+            if seconds > 0:
+                time.sleep(seconds)
+        elif seconds > 0:
+            self._now += seconds
+
+
+class Wheel(object):
+    """
+    Simulated wheel with an encoder
+    """
+
+    def __init__(self, pwm_pin, dir1_pin, dir2_pin, encoder_pin):
+        self.pwm_pin = pwm_pin
+        self.dir1_pin = dir1_pin
+        self.dir2_pin = dir2_pin
+        self.encoder_pin = encoder_pin
+
+        self.speed = 0.0  # signed, ticks/sec
+        self.position = 0.0  # unsigned travel, ticks
+        self.ticks = 0
+        self.last_tick_time = None
+        self.tick_interval = None
+
+
+class World(object):
+    """
+    Simulated QuickBot and its environment.
+    """
+
+    def __init__(self, config):
+        params = dict(DEFAULTS)
+        for param, name in FROM_CONFIG.items():
+            if hasattr(config, name):
+                params[param] = getattr(config, name)
+        params.update(getattr(config, 'SIM', {}))
+        self.params = params
+
+        self.clock = Clock(params['realtime'])
+        self._random = random.Random(params['seed'])
+
+        self.walls = list(params['arena'])
+        self.x, self.y, self.theta = params['start_pose']
+
+        self.left = Wheel(config.MOTOR_LEFT['pwm'], config.MOTOR_LEFT['dir1'], config.MOTOR_LEFT['dir2'],
+                          config.MOTOR_LEFT['encoder_pin'])
+        self.right = Wheel(config.MOTOR_RIGHT['pwm'], config.MOTOR_RIGHT['dir1'], config.MOTOR_RIGHT['dir2'],
+                           config.MOTOR_RIGHT['encoder_pin'])
+        self._wheels = (self.left, self.right)
+
+        self._ir_pins = config.IR_PINS
+        self._inches_per_tick = 2 * math.pi * params['wheel_radius'] / params['ticks_per_rev']
+
+        self.pins = {}
+        self.duty = {}
+
+        self._start = self.clock.time()
+        self._t = 0.0  # simulated time since start
+        self._ir_time = None
+        self._ir_values = [0.0] * 8
+
+        self.GPIO = SimGPIO(self)
+        self.PWM = SimPWM(self)
+
+    def Capture(self):
+        return SimCapture(self)
+
+    def add_obstacle(self, segments):
+        self.walls.extend(segments)
+
+    def set_pose(self, x, y, theta):
+        self.x, self.y, self.theta = x, y, theta
+        self._ir_time = None
+
+    @property
+    def pose(self):
+        return self.x, self.y, self.theta
+
+    @property
+    def time(self):
+        """Simulated time (seconds since the world was created)"""
+        return self._t
+
+    def advance(self):
+        """
+        Integrates world dynamics up to the current clock time.
+        """
+        target = self.clock.time() - self._start
+        step = self.params['step']
+
+        while self._t + step <= target:
+            self._t += step
+            self._step(step)
+
+    def _drive(self, wheel):
+        dir1 = self.pins.get(wheel.dir1_pin, 0)
+        dir2 = self.pins.get(wheel.dir2_pin, 0)
+        if dir1 == dir2:
+            return 0.0
+
+        duty = self.duty.get(wheel.pwm_pin, 0.0) - self.params['deadband']
+        if duty <= 0:
+            return 0.0
+
+        drive = self.params['gain'] * duty
+        return drive if dir2 else -drive
+
+    def _step(self, dt):
+        p = self.params
+        k = dt / p['tau']
+
+        for wheel in self._wheels:
+            drive = self._drive(wheel)
+            wheel.speed += k * (drive - wheel.speed)
+            if drive == 0 and abs(wheel.speed) < 0.5:
+                wheel.speed = 0.0  # friction
+
+            wheel.position += abs(wheel.speed) * dt
+            while wheel.position >= wheel.ticks + 1:
+                wheel.ticks += 1
+                if wheel.last_tick_time is not None:
+                    wheel.tick_interval = self._t - wheel.last_tick_time
+                wheel.last_tick_time = self._t
+
+        vl = self.left.speed * self._inches_per_tick
+        vr = self.right.speed * self._inches_per_tick
+        v = 0.5 * (vl + vr)
+        w = (vr - vl) / p['wheel_base']
+
+        x = self.x + v * math.cos(self.theta) * dt
+        y = self.y + v * math.sin(self.theta) * dt
+        if v == 0 or not self._collides(x, y):
+            self.x, self.y = x, y
+        self.theta = (self.theta + w * dt + math.pi) % (2 * math.pi) - math.pi
+
+    def _collides(self, x, y):
+        r2 = self.params['body_radius'] ** 2
+        for (x0, y0), (x1, y1) in self.walls:
+            dx, dy = x1 - x0, y1 - y0
+            u = ((x - x0) * dx + (y - y0) * dy) / (dx * dx + dy * dy)
+            u = min(max(u, 0.0), 1.0)
+            ex, ey = x0 + u * dx - x, y0 + u * dy - y
+            if ex * ex + ey * ey < r2:
+                return True
+        return False
+
+    def ir_distances(self):
+        """
+        True distances (inches) seen by each IR sensor, in IR_PINS order.
+        """
+        p = self.params
+        out = []
+        for angle in p['ir_angles']:
+            a = self.theta + angle
+            ca, sa = math.cos(a), math.sin(a)
+            sx = self.x + p['ir_offset'] * ca
+            sy = self.y + p['ir_offset'] * sa
+            out.append(min(p['ir_range'], self._ray(sx, sy, ca, sa)))
+        return out
+
+    def _ray(self, sx, sy, ca, sa):
+        best = float('inf')
+        for (x0, y0), (x1, y1) in self.walls:
+            ex, ey = x1 - x0, y1 - y0
+            denom = ca * ey - sa * ex
+            if denom == 0:
+                continue
+            qx, qy = x0 - sx, y0 - sy
+            t = (qx * ey - qy * ex) / denom
+            u = (qx * sa - qy * ca) / denom
+            if t >= 0 and 0 <= u <= 1 and t < best:
+                best = t
+        return best
+
+    def _ir_reading(self, distance):
+        alpha, beta, gamma = self.params['ir_model']
+        v = (alpha * distance + beta) / (distance + gamma)
+        if self.params['ir_noise']:
+            v += self._random.gauss(0, self.params['ir_noise'])
+        return min(max(v, 0.0), 4095.0)
+
+    def adc_values(self, scale):
+        """
+        Raw ADC values, indexed by AIN pin and scaled by 2**EMA_POW (as PRU ADC reports them)
+        """
+        if self._ir_time != self._t:
+            self._ir_time = self._t
+            for pin, d in zip(self._ir_pins, self.ir_distances()):
+                self._ir_values[pin] = self._ir_reading(d) * scale
+        return self._ir_values
+
+
+class SimGPIO(object):
+    """
+    Emulates Adafruit_BBIO.GPIO
+    """
+
+    OUT = 'out'
+    IN = 'in'
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, world):
+        self._world = world
+
+    def setup(self, pin, mode):
+        self._world.pins[pin] = self.LOW
+
+    def output(self, pin, value):
+        self._world.advance()
+        self._world.pins[pin] = value
+
+    def cleanup(self):
+        self._world.pins.clear()
+
+
+class SimPWM(object):
+    """
+    Emulates Adafruit_BBIO.PWM
+    """
+
+    def __init__(self, world):
+        self._world = world
+
+    def start(self, pin, duty):
+        self._world.duty[pin] = duty
+
+    def set_duty_cycle(self, pin, duty):
+        self._world.advance()
+        self._world.duty[pin] = duty
+
+    def stop(self, pin):
+        self._world.duty[pin] = 0
+
+    def cleanup(self):
+        self._world.duty.clear()
+
+
+class SimCapture(object):
+    """
+    Emulates beaglebone_pru_adc.Capture
+    """
+
+    def __init__(self, world):
+        self._world = world
+        self.encoder0_pin = world.left.encoder_pin
+        self.encoder1_pin = world.right.encoder_pin
+        self.encoder0_threshold = 0
+        self.encoder1_threshold = 0
+        self.encoder0_delay = 0
+        self.encoder1_delay = 0
+        self.ema_pow = 0
+
+    def start(self):
+        self._world.advance()
+
+    def stop(self):
+        pass
+
+    def wait(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _wheel(self, pin):
+        self._world.advance()
+        return self._world.left if pin == self._world.left.encoder_pin else self._world.right
+
+    def _inverse_speed(self, wheel):
+        if wheel.tick_interval is None:
+            return ENCODER_SPEED_IDLE
+        interval = self._world.time - wheel.last_tick_time
+        if interval < wheel.tick_interval:
+            interval = wheel.tick_interval
+        return int(interval * Sensors.TIMERTICKS_PER_SEC)
+
+    @property
+    def timer(self):
+        self._world.advance()
+        return int(self._world.time * Sensors.TIMERTICKS_PER_SEC)
+
+    @property
+    def encoder0_ticks(self):
+        return self._wheel(self.encoder0_pin).ticks
+
+    @property
+    def encoder1_ticks(self):
+        return self._wheel(self.encoder1_pin).ticks
+
+    @property
+    def encoder0_speed(self):
+        return self._inverse_speed(self._wheel(self.encoder0_pin))
+
+    @property
+    def encoder1_speed(self):
+        return self._inverse_speed(self._wheel(self.encoder1_pin))
+
+    @property
+    def values(self):
+        self._world.advance()
+        return self._world.adc_values(2 ** self.ema_pow)
+
+
+if __name__ == '__main__':
+    import argparse
+    import config
+    from robot.controller import BotController
+
+    parser = argparse.ArgumentParser('Run BotController against simulated robot, faster than real time')
+    parser.add_argument('--seconds', type=float, default=60.0, help='simulated time to run')
+    parser.add_argument('--speed', type=float, default=40.0, help='wheel speed to command')
+
+    cmd = parser.parse_args()
+
+    config.BACKEND = 'sim'
+    config.SIM = dict(getattr(config, 'SIM', {}), realtime=False)
+
+    bot = BotController(config)
+    clock = bot.clock
+    bot.start()
+
+    ticks = int(cmd.seconds / 0.01)
+    start = time.time()
+    for i in range(ticks):
+        clock.sleep(0.01)
+        bot.on_timer()
+        if i == ticks // 10:
+            bot.run(cmd.speed, cmd.speed)
+    elapsed = time.time() - start
+    bot.stop()
+
+    print 'Simulated %.1f sec in %.3f sec (%.0fx real time), %.1f usec per tick' % (
+        cmd.seconds, elapsed, cmd.seconds / elapsed, elapsed / ticks * 1e6)
+    print 'Ticks:', bot.ticks, 'speed:', bot.actual_speed
+    print 'Motor pin writes: %.1f/sec, elided: %.1f/sec' % (
+        bot._motors.writes / cmd.seconds, bot._motors.elided / cmd.seconds)
@@ -0,0 +1,92 @@
+"""
+Low-overhead statistics helpers
+"""
+import bisect
+from array import array
+
+
+class Histogram(object):
+    """
+    Fixed-bucket histogram. Adding a sample does not allocate memory.
+
+    Buckets are defined by a sorted sequence of upper bounds. Samples larger than
+    the last bound go into an extra overflow bucket.
+
+    Example:
+
+        h = Histogram(Histogram.log_bounds(1e-6, 1.0))
+        h.add(0.0012)
+        print h.mean, h.percentile(99)
+    """
+
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = array('L', [0] * (len(self.bounds) + 1))
+        self.reset()
+
+    @classmethod
+    def log_bounds(cls, lo, hi, per_decade=10):
+        """Logarithmically spaced bucket bounds from |lo| to |hi|"""
+        bounds = []
+        b = lo
+        while b < hi * (1 + 1e-9):
+            bounds.append(b)
+            b *= 10 ** (1.0 / per_decade)
+        return bounds
+
+    @classmethod
+    def linear_bounds(cls, lo, hi, count):
+        """|count| equally spaced bucket bounds from |lo| to |hi|"""
+        step = (hi - lo) / float(count - 1)
+        return [lo + i * step for i in range(count)]
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        self.counts[bisect.bisect_left(self.bounds, x)] += 1
+        self.count += 1
+        self.total += x
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return None
+        return self.total / self.count
+
+    def percentile(self, p):
+        """
+        Returns upper bound of the bucket containing p-th percentile (clamped by the observed
+        maximum). Accuracy is limited by the bucket resolution.
+        """
+        if self.count == 0:
+            return None
+
+        rank = p / 100.0 * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank and c > 0:
+                if i == len(self.bounds):
+                    return self.max
+                return min(self.bounds[i], self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'mean': self.mean,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+        }
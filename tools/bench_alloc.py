@@ -0,0 +1,132 @@
+"""
+Checks that the control tick does not allocate memory in steady state.
+
+Python 2.7 has no tracemalloc, so allocations are detected with the garbage collector: its generation 0
+counter goes up by one for every container object (tuple, list, dict, instance, generator, closure, ...)
+taken from the heap. The probe sets the collection threshold to 1 and primes the counter with one object,
+so a single new container allocated inside the measured call triggers a collection, which is then
+counted. Objects recycled from CPython's free lists (numbers, bound methods, recently freed tuples and
+lists) do not touch the heap and are not counted, and neither are non-container objects (strings, arrays).
+A container freed inside the call before the first allocation lowers the counter and can hide that one
+allocation.
+
+Code on the tick path (including the simulated hardware it reads) clamps with comparisons rather than
+min()/max(), and loops with while and an index: builtins that take several arguments or iterate allocate
+an iterator object on every call.
+
+The simulator allocates while it integrates, so before every measured call the world is advanced by one
+control period outside the probe. The measured tick then sees new timer, encoder and IR values, the PID
+moves the torque and motor pins are written, as on the robot.
+
+    python -m tools.bench_alloc --ticks 2000
+"""
+import argparse
+import gc
+import time
+
+import config
+from qb import QB
+
+
+class _Primer(object):
+    """Instances are always taken from the heap (unlike dicts, tuples and lists, which have free lists)"""
+
+
+def allocations(func, calls, setup=None):
+    """
+    Returns number of calls of |func| that allocated container objects on the heap. |setup| is called
+    before every call of |func|, its allocations are not counted.
+    """
+    gc.collect()
+    if setup:
+        setup()
+    func()  # first call creates frames and refills free lists (emptied by full collection)
+    thresholds = gc.get_threshold()
+    gc.disable()
+    gc.set_threshold(1, 1 << 30, 1 << 30)
+
+    count = 0
+    try:
+        for _ in xrange(calls):
+            if setup:
+                setup()
+            collections = gc.get_count()[1]
+            gc.collect(0)  # also increments the generation 1 counter
+            primer = _Primer()  # counter is now 1: next allocation triggers a collection
+            gc.enable()
+            func()
+            gc.disable()
+            if gc.get_count()[1] > collections + 1:
+                count += 1
+            del primer
+    finally:
+        gc.set_threshold(*thresholds)
+        gc.enable()
+    return count
+
+
+def per_call(func, calls, setup=None):
+    total = 0.0
+    for _ in xrange(calls):
+        if setup:
+            setup()
+        start = time.time()
+        func()
+        total += time.time() - start
+    return total / calls * 1e6
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Heap allocations of the control tick')
+    parser.add_argument('--ticks', type=int, default=2000)
+    cmd = parser.parse_args()
+
+    config.BACKEND = 'sim'
+    config.SIM = dict(getattr(config, 'SIM', {}), realtime=False)
+
+    qb = QB(config)
+    qb.start()
+    bot = qb._bot
+    clock = qb.clock
+
+    # get the robot moving, so that all branches of the controller are exercised
+    qb.set_speed(40, 30)
+    for _ in range(200):
+        clock.sleep(0.01)
+        qb.on_timer()
+
+    def advance():
+        """Moves simulated world one control period ahead (sensors pick it up on the next read)"""
+        clock.sleep(config.CONTROL_PERIOD)
+        bot._sensors.read()
+
+    speeds = [40.0, 30.0]
+
+    def swap_speeds():
+        """Makes every motors.run() call below change the duty cycle, so pins are actually written"""
+        speeds.reverse()
+
+    ir = [0.0] * len(config.IR_PINS)
+    stages = [
+        ('tick', lambda: bot.on_timer(), advance),
+        ('sensors', lambda: bot._sensors.read(), advance),
+        ('helper', lambda: bot._left.on_timer(), advance),
+        ('motors', lambda: bot._motors.run(speeds[0], speeds[1]), swap_speeds),
+        ('odometry', lambda: bot.odometry.update(bot._left.ticks, bot._right.ticks), advance),
+        ('get_ir', lambda: qb.get_ir(), advance),
+        ('get_ir_into', lambda: qb.get_ir_into(ir), advance),
+        ('get_ir_distances', lambda: qb.get_ir_distances(), advance),
+        ('get_ir_distances_into', lambda: qb.get_ir_distances_into(ir), advance),
+    ]
+
+    bot.recorder.enable()
+    stages.append(('tick (recording)', lambda: bot.on_timer(), advance))
+
+    print '%-24s %12s %10s %12s' % ('stage', 'allocating', 'usec/call', 'pin writes')
+    for name, func, setup in stages:
+        count = allocations(func, cmd.ticks, setup)
+        writes = bot._motors.writes
+        usec = per_call(func, cmd.ticks, setup)
+        print '%-24s %6d/%-5d %10.1f %12d' % (name, count, cmd.ticks, usec, bot._motors.writes - writes)
+
+    qb.stop()
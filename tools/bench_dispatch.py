@@ -0,0 +1,83 @@
+"""
+Measures QBServer command throughput: parser alone, and the full dispatch path
+(parse, look up handler, query simulated robot, format and send reply).
+
+Queries and actions, and set commands (with arguments that change every time) are measured separately.
+Every figure is the best of several runs, to reduce scheduling noise.
+
+    python -m tools.bench_dispatch
+"""
+import re
+import timeit
+
+import config
+import protocol
+
+
+QUERIES = ['$IRDIST?*\n', '$ENVAL?*\n', '$STATE?*\n', '$CHECK*\n']
+SETS = ['$PWM=%.1f,%.1f*\n' % (40 + i * 0.1, 40 - i * 0.1) for i in range(100)]
+
+LEGACY_RE = re.compile(r'\$(?P<CMD>[A-Z]{3,})(?P<SET>=?)(?P<QUERY>\??)(?(2)(?P<ARGS>.*)).*\*')
+
+
+def legacy_parse(line):
+    """Parser used by QBServer before the dispatch tables (for comparison)"""
+    mtc = LEGACY_RE.match(line)
+    return mtc.group('CMD'), mtc.group('SET'), mtc.group('QUERY'), mtc.group('ARGS')
+
+
+def rate(func, args, calls=20000, repeat=5):
+    """Calls func(arg) for |args| in turn, |calls| times per run; returns calls per second of the best run"""
+    def run():
+        for i in xrange(calls):
+            func(args[i % len(args)])
+    return calls / min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+if __name__ == '__main__':
+    from qb_server import QBServer
+
+    config.BACKEND = 'sim'
+    config.SIM = dict(getattr(config, 'SIM', {}), realtime=False)
+    config.ROBOT_IP = '127.0.0.1'
+    config.PORT = 0
+
+    qb = QBServer(config)
+    qb.start()
+    qb.on_timer()
+
+    # replies go to a local port nobody listens to
+    addr = ('127.0.0.1', qb._sock.getsockname()[1] + 1)
+    qb._binary_clients.add(addr)
+
+    frames = [
+        protocol.encode_request(protocol.SET_SPEED, 1, 40.0, 40.0),
+        protocol.encode_request(protocol.GET_IR_DISTANCES, 2),
+        protocol.encode_request(protocol.GET_TICKS, 3),
+        protocol.encode_request(protocol.GET_STATE, 4),
+        protocol.encode_request(protocol.CHECK, 5),
+    ]
+
+    def dispatch_frame(frame):
+        qb._in[:len(frame)] = frame
+        qb.handle_frame(len(frame), addr)
+
+    buf = bytearray(1024)
+
+    def parse_frame(frame):
+        buf[:len(frame)] = frame
+        protocol.decode_request_from(buf, len(frame))
+
+    def text(line):
+        qb.handle_line(line, addr)
+
+    try:
+        print '%-28s %14s %14s' % ('commands/s', 'queries', 'set commands')
+        print '%-28s %14.0f %14.0f' % ('parse: regex (legacy)', rate(legacy_parse, QUERIES), rate(legacy_parse, SETS))
+        print '%-28s %14.0f %14.0f' % ('parse: parse_command',
+                                       rate(protocol.parse_command, QUERIES), rate(protocol.parse_command, SETS))
+        print '%-28s %14.0f' % ('parse: binary frames', rate(parse_frame, frames))
+        print '%-28s %14.0f %14.0f' % ('dispatch: text', rate(text, QUERIES), rate(text, SETS))
+        print '%-28s %14.0f' % ('dispatch: binary', rate(dispatch_frame, frames))
+    finally:
+        qb.stop()
@@ -0,0 +1,111 @@
+"""
+Measures cost of a base station control tick (query state of every robot, then set speeds) as the
+fleet grows, against simulated robots (one process each) on loopback addresses 127.0.1.x.
+For comparison, the same tick is run waiting for each reply in turn, as separate QBClients would.
+
+    python -m tools.bench_fleet --robots 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import socket
+import time
+import types
+
+import config
+from qb_fleet import Fleet
+from qb_server import QBServer
+from robot.stats import Histogram
+
+
+BASE_IP = '127.0.0.1'
+PORT = 5025
+
+
+def robot_config(index):
+    """Copy of config for one simulated robot (each gets its own simulated world)"""
+    cfg = types.ModuleType('config')
+    cfg.__dict__.update(vars(config))
+    cfg.BACKEND = 'sim'
+    cfg.ROBOT_IP = '127.0.1.%d' % (index + 1)
+    cfg.BASE_IP = BASE_IP
+    cfg.PORT = PORT
+    return cfg
+
+
+def serve(index, ready):
+    qb = QBServer(robot_config(index))
+    qb.start()
+    qb.scheduler.start()
+    ready.set()
+    try:
+        qb.serve()
+    finally:
+        qb.stop()
+
+
+def start_robots(count):
+    """Starts |count| simulated robots, each in its own process. Returns list of (robot IP, process)."""
+    robots = []
+    for i in range(count):
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(target=serve, args=(i, ready))
+        process.daemon = True
+        process.start()
+        ready.wait()
+        robots.append((robot_config(i).ROBOT_IP, process))
+    return robots
+
+
+def stop_robots(robots):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for robot_ip, process in robots:
+        sock.sendto('$END*\n', (robot_ip, PORT))
+        process.join(1.0)
+        if process.is_alive():
+            process.terminate()
+    sock.close()
+
+
+def concurrent_tick(fleet):
+    fleet.get_state()
+    fleet.set_speed([(40, 40)] * len(fleet))
+
+
+def sequential_tick(fleet):
+    """Same as concurrent_tick, but waits for each reply in turn (like one QBClient per robot)"""
+    for robot in fleet:
+        robot.get_state()
+        robot.set_speed(40, 40)
+
+
+def measure(count, ticks):
+    """Returns (concurrent, sequential) summaries of tick time"""
+    servers = start_robots(count)
+    try:
+        with Fleet.connect([robot_ip for robot_ip, _ in servers], BASE_IP, PORT) as fleet:
+            result = []
+            for tick in (concurrent_tick, sequential_tick):
+                histogram = Histogram(Histogram.log_bounds(1e-5, 1.0, per_decade=20))
+                for _ in range(ticks):
+                    start = time.time()
+                    tick(fleet)
+                    histogram.add(time.time() - start)
+                    time.sleep(0.01)
+                result.append(histogram.summary())
+            return result
+    finally:
+        stop_robots(servers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Base station tick cost vs fleet size')
+    parser.add_argument('--robots', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--ticks', type=int, default=200)
+    cmd = parser.parse_args()
+
+    print 'Tick time, ms'
+    print '%6s %12s %12s %12s %12s' % ('robots', 'mean', 'p99', 'sequential', 'p99')
+    for count in cmd.robots:
+        concurrent, sequential = measure(count, cmd.ticks)
+        print '%6d %12.2f %12.2f %12.2f %12.2f' % (count, concurrent['mean'] * 1e3, concurrent['p99'] * 1e3,
+                                                   sequential['mean'] * 1e3, sequential['p99'] * 1e3)
@@ -0,0 +1,152 @@
+"""
+Measures obstacle reaction latency of the simple behavior (qb_simple_behavior.Supervisor), run onboard
+(inside QBServer loop) versus remotely (over QBClient, as from the base station).
+
+Each trial starts a simulated robot facing a wall. Latency is the time from the moment the wall
+is closer than GO_STRAIGHT['distance_threshold'] (true distance, seen by the simulator) to the moment
+the stop command reaches the controller; travel is how far the robot moved in the meantime.
+
+    python -m tools.bench_obstacle --trials 10 --delay 0.015
+
+|--delay| adds that many seconds to every remote round trip (Wi-Fi is much slower than loopback).
+"""
+import argparse
+import math
+import random
+import socket
+import threading
+import time
+import types
+
+import config
+from qb_client import QBClient
+from qb_server import QBServer
+from qb_simple_behavior import Supervisor
+from robot.backend import get_backend
+
+
+ROBOT_IP = '127.0.0.1'
+BASE_IP = '127.0.0.2'
+PORT = 5035
+
+
+class Monitor(object):
+    """
+    Watches simulated world from the server control loop, records when obstacle became visible
+    and when the stop command arrived.
+    """
+
+    def __init__(self, qb, world, threshold):
+        self._world = world
+        self._threshold = threshold
+        self.detected = None  # (time, x, y)
+        self.stopped = None
+        self.done = threading.Event()
+
+        control = qb.scheduler.task('control')
+        on_control = control.func
+        set_speed = qb.set_speed
+
+        def monitored_on_control():
+            on_control()
+            if self.detected is None and min(world.ir_distances()[1:4]) < threshold:
+                self.detected = world.time, world.x, world.y
+
+        def monitored_set_speed(left, right):
+            set_speed(left, right)
+            if self.detected is not None and self.stopped is None and left <= 0 and right <= 0:
+                self.stopped = world.time, world.x, world.y
+                self.done.set()
+
+        control.func = monitored_on_control
+        qb.set_speed = monitored_set_speed
+
+    def result(self):
+        """Returns (latency in seconds, travel in inches)"""
+        t0, x0, y0 = self.detected
+        t1, x1, y1 = self.stopped
+        return t1 - t0, math.hypot(x1 - x0, y1 - y0)
+
+
+class Delayed(object):
+    """Adds |delay| seconds to every call of the wrapped client"""
+
+    def __init__(self, qb, delay):
+        self._qb = qb
+        self._delay = delay
+
+    def __getattr__(self, name):
+        method = getattr(self._qb, name)
+
+        def delayed(*av):
+            time.sleep(self._delay)
+            return method(*av)
+        return delayed
+
+
+def trial_config(rnd):
+    cfg = types.ModuleType('config')
+    cfg.__dict__.update(vars(config))
+    cfg.BACKEND = 'sim'
+    cfg.ROBOT_IP, cfg.BASE_IP, cfg.PORT = ROBOT_IP, BASE_IP, PORT
+    cfg.SIM = dict(config.SIM, realtime=True, start_pose=(rnd.uniform(0, 20), 0., rnd.uniform(-0.2, 0.2)))
+    return cfg
+
+
+def trial(cfg, onboard, delay, timeout=20.0):
+    threshold = cfg.GO_STRAIGHT['distance_threshold']
+
+    qb = QBServer(cfg, Supervisor(cfg) if onboard else None)
+    monitor = Monitor(qb, get_backend(cfg).world, threshold)
+    qb.start()
+    qb.scheduler.start()
+    server = threading.Thread(target=qb.serve)
+    server.start()
+
+    try:
+        if onboard:
+            monitor.done.wait(timeout)
+        else:
+            supervisor = Supervisor(cfg)
+            client = QBClient(ROBOT_IP, BASE_IP, PORT)
+            remote = Delayed(client, delay) if delay else client
+            deadline = time.time() + timeout
+            try:
+                while not monitor.done.is_set() and time.time() < deadline:
+                    time.sleep(0.02)  # same loop as qb_simple_behavior.py
+                    supervisor.execute(remote)
+            finally:
+                client.close()
+    finally:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.sendto('$END*\n', (ROBOT_IP, PORT))
+        sock.close()
+        server.join()
+        qb.stop()
+
+    if monitor.stopped is None:
+        return None
+    return monitor.result()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Obstacle reaction latency, onboard vs remote behavior')
+    parser.add_argument('--trials', type=int, default=10)
+    parser.add_argument('--delay', type=float, default=0.0, help='extra seconds per remote round trip')
+    parser.add_argument('--seed', type=int, default=1)
+    cmd = parser.parse_args()
+
+    print '%-8s %8s %12s %12s %12s' % ('mode', 'trials', 'mean ms', 'max ms', 'travel in')
+    for onboard in (True, False):
+        # configs are kept alive for the whole run: each gets its own simulated world (see get_backend())
+        rnd = random.Random(cmd.seed)
+        configs = [trial_config(rnd) for _ in range(cmd.trials)]
+        results = [r for r in (trial(cfg, onboard, cmd.delay) for cfg in configs) if r is not None]
+        if not results:
+            print '%-8s no stops recorded' % ('onboard' if onboard else 'remote')
+            continue
+        latencies = [r[0] for r in results]
+        travel = [r[1] for r in results]
+        print '%-8s %8d %12.1f %12.1f %12.2f' % (
+            'onboard' if onboard else 'remote', len(results),
+            sum(latencies) / len(latencies) * 1e3, max(latencies) * 1e3, sum(travel) / len(travel))
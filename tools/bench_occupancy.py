@@ -0,0 +1,94 @@
+"""
+Measures throughput of the occupancy grid mapper (tools/occupancy.py) in samples per second, adding samples
+one by one (as from a live robot) and in batches (e.g. a recorded run), and compares memory used by the
+tiles with a dense grid covering the same area.
+
+Samples are poses along a random walk (1 inch steps) among obstacles scattered around the origin of a large
+simulated arena, with true IR distances (see robot/sim.py). Tiles only cover the explored area, while a dense
+grid would have to cover the whole arena.
+
+    python -m tools.bench_occupancy --samples 5000 --arena 6000
+"""
+import argparse
+import math
+import os
+import random
+import tempfile
+import time
+import types
+
+import config
+from robot.sim import World
+from tools.occupancy import OccupancyGrid
+
+
+def make_samples(count, arena, seed=1):
+    """Returns (poses, distances) of |count| poses in a square arena |arena| inches wide"""
+    rnd = random.Random(seed)
+    half = arena / 2.0
+    cfg = types.ModuleType('config')
+    cfg.__dict__.update(vars(config))
+    cfg.SIM = dict(config.SIM, realtime=False, arena=[
+        ((-half, -half), (half, -half)), ((half, -half), (half, half)),
+        ((half, half), (-half, half)), ((-half, half), (-half, -half)),
+    ])
+    world = World(cfg)
+    for _ in range(50):
+        # 6 inch square posts
+        x, y = rnd.uniform(-150, 150), rnd.uniform(-150, 150)
+        world.add_obstacle([((x, y), (x + 6, y)), ((x + 6, y), (x + 6, y + 6)),
+                            ((x + 6, y + 6), (x, y + 6)), ((x, y + 6), (x, y))])
+
+    x, y, theta = 0., 0., 0.
+    poses, distances = [], []
+    for _ in range(count):
+        world.set_pose(x, y, theta)
+        poses.append((x, y, theta))
+        distances.append(world.ir_distances())
+
+        theta += rnd.gauss(0, 0.2)
+        x = min(max(x + math.cos(theta), -half), half)
+        y = min(max(y + math.sin(theta), -half), half)
+    return poses, distances
+
+
+def measure(poses, distances, batch, resolution):
+    grid = OccupancyGrid.from_config(config, resolution)
+    start = time.time()
+    if batch == 1:
+        for pose, d in zip(poses, distances):
+            grid.update(pose, d)
+    else:
+        for i in range(0, len(poses), batch):
+            grid.update_batch(poses[i:i + batch], distances[i:i + batch])
+    return len(poses) / (time.time() - start), grid
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Occupancy grid mapper throughput')
+    parser.add_argument('--samples', type=int, default=5000)
+    parser.add_argument('--arena', type=float, default=6000.0, help='arena width, inches')
+    parser.add_argument('--resolution', type=float, default=1.0, help='cell size, inches')
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10, 100, 1000])
+    cmd = parser.parse_args()
+
+    poses, distances = make_samples(cmd.samples, cmd.arena)
+
+    print '%8s %14s' % ('batch', 'samples/s')
+    for batch in cmd.batch:
+        rate, grid = measure(poses, distances, batch, cmd.resolution)
+        print '%8d %14.0f' % (batch, rate)
+
+    dense = (cmd.arena / cmd.resolution) ** 2 * 4
+    print 'Tiles: %d, %.1f MB (dense grid of the arena: %.1f MB)' % (len(grid.tiles), grid.nbytes / 1e6, dense / 1e6)
+
+    filename = os.path.join(tempfile.mkdtemp(), 'map.npz')
+    start = time.time()
+    grid.save(filename)
+    saved = time.time() - start
+    start = time.time()
+    loaded = OccupancyGrid.load(filename)
+    print 'Save %.3f s, load %.3f s, %.1f MB on disk' % (saved, time.time() - start, os.path.getsize(filename) / 1e6)
+    assert sorted(loaded.tiles) == sorted(grid.tiles)
+    os.remove(filename)
+    os.rmdir(os.path.dirname(filename))
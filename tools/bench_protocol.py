@@ -0,0 +1,59 @@
+"""
+Compares text and binary wire protocols: message size, cost of building a reply (server side),
+and cost of parsing it (client side).
+
+    python -m tools.bench_protocol
+"""
+import timeit
+
+import protocol
+from protocol import State, format_state
+from qb_client import parse_tuple
+
+
+STATE = State(123456, (1234, -567), (41.6523235801, -38.4615384615),
+              (173.609375, 512.25, 1024.5, 88.125, 173.609375),
+              (32.0, 10.8452830189, 5.42264150943, 63.0396341463, 32.0))
+
+MESSAGES = [
+    # name, values, text command, binary type
+    ('speed', STATE.speed, '$PWM?*\n', protocol.GET_SPEED),
+    ('ticks', STATE.ticks, '$ENVAL?*\n', protocol.GET_TICKS),
+    ('ir_distances', STATE.ir_distances, '$IRDIST?*\n', protocol.GET_IR_DISTANCES),
+    ('state', STATE.flatten(), '$STATE?*\n', protocol.GET_STATE),
+]
+
+
+def text_reply(values):
+    return '[%s]\n' % ', '.join(str(x) for x in values)
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=3)) / number * 1e6
+
+
+if __name__ == '__main__':
+    number = 20000
+
+    print '%-14s %8s %8s   %12s %12s   %12s %12s' % (
+        'message', 'text B', 'bin B', 'text fmt us', 'bin fmt us', 'text parse us', 'bin parse us')
+
+    for name, values, command, msg_type in MESSAGES:
+        text = text_reply(values)
+        binary = protocol.encode_reply(msg_type, 1, *values)
+
+        request_text = len(command)
+        request_binary = len(protocol.encode_request(msg_type, 1))
+
+        text_fmt = measure(lambda: text_reply(values), number)
+        bin_fmt = measure(lambda: protocol.encode_reply(msg_type, 1, *values), number)
+        text_parse = measure(lambda: parse_tuple(text), number)
+        bin_parse = measure(lambda: protocol.decode_reply(binary), number)
+
+        print '%-14s %8d %8d   %12.2f %12.2f   %12.2f %12.2f' % (
+            name, request_text + len(text), request_binary + len(binary),
+            text_fmt, bin_fmt, text_parse, bin_parse)
+
+    print
+    print 'Bytes are per round trip (request + reply), times are per message.'
+    print 'State via format_state():', '%.2f us' % measure(lambda: format_state(STATE), number)
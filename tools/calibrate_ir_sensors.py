@@ -1,12 +1,18 @@
 import beaglebone_pru_adc as adc
 import time
 import collections
+import os
 import sys
 import config
 from robot.motor import Motors
 
 if __name__ == '__main__':
 
+    # captured samples go to this directory (name it after the obstacle distance, see tools/fit.py)
+    directory = sys.argv[1] if len(sys.argv) > 1 else '.'
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
     print 'Capturing IR values, wait 5 seconds\n',
 
     adc = adc.Capture()
@@ -47,5 +53,5 @@ if __name__ == '__main__':
 
 	print '#%d: RANGE: %4.2lf--%4.2lf, MEAN: %4.2lf, MEDIAN: %4.2lf' % (i, min_, max_, mean, median)
 
-	with open('x%s.csv' % i, 'wb') as f:
+	with open(os.path.join(directory, 'x%s.csv' % i), 'wb') as f:
             f.write('\n'.join(str(x) for x in stat[i]))
@@ -55,10 +55,59 @@ Solution can be found if we know inverse of M, Mn1:
     (alpha, beta, gamma) = Mn1 * f
 
 Function fit(d, v) below performs all these manipulations to compute vector (alpha, beta, gamma)
+
+With more than three measurements (e.g. hundreds of samples captured at each of several distances)
+the system is overdetermined, and we solve it in the least squares sense instead:
+
+    (M^T * M) * (alpha, beta, gamma) = M^T * f
+
+Function fit_all(d, v) does this for all sensors at once.
+
+Calibration pipeline:
+
+    1. Capture samples at several distances with tools/calibrate_ir_sensors.py, one directory per
+       distance (directory name is the distance in inches):
+
+        python -m tools.calibrate_ir_sensors captures/6
+        python -m tools.calibrate_ir_sensors captures/12
+        python -m tools.calibrate_ir_sensors captures/24
+
+    2. Fit and write calibration file that QB loads at startup (see IR_CALIBRATION_FILE in config.py):
+
+        python -m tools.fit captures/6 captures/12 captures/24 -o ir_calibration.json
 """
+import glob
+import json
+import os
+import re
+
 import numpy
 
 
+def fit_all(d, v):
+    """
+    Least squares fit of all sensors at once.
+
+    |d| is an array of N distances, |v| is an array of shape (S, N) where v[s, i] is the reading
+    of sensor s at distance d[i]. Returns array of shape (S, 3) with (alpha, beta, gamma)
+    of each sensor.
+    """
+    d = numpy.asarray(d, dtype=float)
+    v = numpy.asarray(v, dtype=float)
+
+    # m[s] is N x 3 matrix (2), f[s] is N-vector, for each sensor s
+    m = numpy.empty(v.shape + (3,))
+    m[..., 0] = d
+    m[..., 1] = 1.
+    m[..., 2] = -v
+    f = d * v
+
+    mtm = numpy.einsum('sni,snj->sij', m, m)
+    mtf = numpy.einsum('sni,sn->si', m, f)
+
+    return numpy.linalg.solve(mtm, mtf[..., None])[..., 0]
+
+
 def fit(d, v):
     """
     Given measurements d[i] and v[i] for i=0,1,2 computes coefficients
@@ -72,19 +121,67 @@ def fit(d, v):
     or
 
         d = (beta - gamma * v) / (v - alpha)
+
+    With more than three measurements, finds least squares solution.
     """
 
-    m = numpy.matrix([
-        [d[0], 1., -v[0]],
-        [d[1], 1., -v[1]],
-        [d[2], 1., -v[2]],
-    ])
+    alpha, beta, gamma = fit_all(d, [v])[0]
 
-    mn1 = numpy.linalg.inv(m)
+    return alpha, beta, gamma
 
-    solution = numpy.dot(mn1, numpy.array([d[0]*v[0], d[1]*v[1], d[2]*v[2]]))
 
-    return solution[0, 0], solution[0, 1], solution[0, 2]
+def distances(coefficients, v):
+    """
+    Vectorized version of distance() (without the 100 inches clamp): |coefficients| is (S, 3)
+    array, |v| is (S, N) array of readings. Returns (S, N) array of distances.
+    """
+    alpha, beta, gamma = [c[:, None] for c in numpy.asarray(coefficients, dtype=float).T]
+    return (beta - gamma * v) / (v - alpha)
+
+
+def residuals(coefficients, d, v):
+    """
+    Returns (S, N) array of distance errors (inches) of the fitted model
+    """
+    return distances(coefficients, numpy.asarray(v, dtype=float)) - numpy.asarray(d, dtype=float)
+
+
+def load_captures(directories):
+    """
+    Loads samples written by tools/calibrate_ir_sensors.py. Each directory contains files
+    x0.csv, x1.csv, ... (one per sensor, one sample per line), and its name is the distance
+    in inches.
+
+    Returns (d, v) suitable for fit_all().
+    """
+    d = []
+    v = []
+    for directory in directories:
+        distance = float(os.path.basename(os.path.normpath(directory)))
+
+        files = sorted(glob.glob(os.path.join(directory, 'x*.csv')),
+                       key=lambda name: int(re.search(r'x(\d+)\.csv$', name).group(1)))
+        if not files:
+            raise ValueError('No captures found in %s' % directory)
+
+        samples = [numpy.loadtxt(name, ndmin=1) for name in files]
+        count = min(len(x) for x in samples)
+
+        d.append(numpy.full(count, distance))
+        v.append(numpy.array([x[:count] for x in samples]))
+
+    if len(set(x.shape[0] for x in v)) != 1:
+        raise ValueError('All captures must have the same number of sensors')
+
+    return numpy.concatenate(d), numpy.concatenate(v, axis=1)
+
+
+def save(filename, coefficients, rms=None):
+    data = {'sensors': [list(map(float, c)) for c in coefficients]}
+    if rms is not None:
+        data['rms_error'] = list(map(float, rms))
+    with open(filename, 'w') as f:
+        json.dump(data, f, indent=4)
 
 
 def distance(alpha, beta, gamma, v):
@@ -109,43 +206,38 @@ def distance(alpha, beta, gamma, v):
 
 
 if __name__ == '__main__':
-    """
-    To calibrate IR sensors do the following:
-
-    Put bot in the center of the room (far from obstacles).
+    import argparse
 
-    1. Find a good "obstacle" (e.g. a book or a case). Use ruler to position this
-    obstacle 3 inches from a sensor. Do the measurement of resulting voltage.
+    parser = argparse.ArgumentParser('Fit IR sensor calibration from captured samples')
+    parser.add_argument('captures', nargs='+', help='capture directories, named by the distance in inches')
+    parser.add_argument('-o', '--output', default='ir_calibration.json', help='calibration file to write')
+    parser.add_argument('--plot', action='store_true', help='plot fitted curves')
 
-    2. Repeat for all 5 sensors
+    cmd = parser.parse_args()
 
-    3. Repeat again this time positioning an obstacle 6 inches away
+    d, v = load_captures(cmd.captures)
+    coefficients = fit_all(d, v)
+    errors = residuals(coefficients, d, v)
+    rms = numpy.sqrt(numpy.mean(errors ** 2, axis=1))
 
-    3. And repeat last time, positioning an obstacle 12 inches away.
-    """
+    print 'Fitted %d sensors from %d samples at distances %s' % (
+        v.shape[0], v.shape[1], ', '.join('%g' % x for x in sorted(set(d))))
+    for sensor, (c, e) in enumerate(zip(coefficients, errors)):
+        print '#%d: alpha=%10.3f beta=%10.3f gamma=%8.3f   RMS error %6.3fin, max %6.3fin' % (
+            sensor, c[0], c[1], c[2], rms[sensor], numpy.abs(e).max())
+        for at_distance in sorted(set(d)):
+            at = e[d == at_distance]
+            print '      at %5gin: mean error %+6.3fin, std %6.3fin' % (at_distance, at.mean(), at.std())
 
-    ## each of total 5 sensors at 6in:
-    v6  = [898, 862, 769, 989, 719]
-
-    ## at 12in
-    v12 = [469, 523, 382, 454, 302]
-
-    ## at 24in
-    v24 = [270, 346, 106, 188, 113]
-
-    print 'IR_CALIBRATION=['
-    for sensor in range(5):
-        print '\t', fit([6, 12, 24], [v6[sensor], v12[sensor], v24[sensor]]), ','
-    print ']'
-
-    for sensor in range(5):
-        alpha, beta, gamma = fit([6, 12, 24], [v6[sensor], v12[sensor], v24[sensor]])
-        dd = []
-        for vv in range(0, 4000):
-            dd.append(distance(alpha, beta, gamma, vv))
+    save(cmd.output, coefficients, rms)
+    print 'Calibration written to', cmd.output
 
+    if cmd.plot:
         import matplotlib.pyplot as plt
 
-        plt.plot(dd)
-
-    plt.show()
+        vv = numpy.arange(0, 4096)
+        for sensor, c in enumerate(coefficients):
+            plt.plot(vv, [distance(c[0], c[1], c[2], x) for x in vv], label='#%d' % sensor)
+            plt.scatter(v[sensor], d, s=2)
+        plt.legend()
+        plt.show()
@@ -0,0 +1,259 @@
+"""
+Occupancy grid map built from IR distances and robot pose.
+
+Every sample is a pose (x, y, theta; see QB.get_pose()) and the IR distances seen from it (QB.get_ir_distances()).
+Each sensor reading is a ray from the sensor (mounted as IR_ANGLES, IR_OFFSET in config.py): cells along
+the ray are evidence of free space, the cell at its end is evidence of an obstacle (unless the reading is
+at or beyond IR_RANGE, which means the sensor saw nothing). Evidence is accumulated as log-odds.
+
+Rays of all sensors (and of all samples, see update_batch()) are traversed at once with numpy: points are
+sampled along every ray at half-cell steps, converted to cells, and consecutive duplicates are dropped.
+
+Grid is stored in square tiles of TILE x TILE cells, allocated when a ray first touches them, so the map
+does not need to know the arena size in advance and memory grows only with the explored area.
+
+    grid = OccupancyGrid.from_config(config)
+    while True:
+        grid.update(qb.get_pose(), qb.get_ir_distances())
+    grid.save('arena.npz')
+    print grid.render()
+
+Map the simulated arena, driving with the simple behavior (see qb_simple_behavior.py):
+
+    python -m tools.occupancy --seconds 120 -o arena.npz
+"""
+import math
+
+import numpy as np
+
+
+TILE_BITS = 6
+TILE = 1 << TILE_BITS  # tile is TILE x TILE cells
+
+# cell coordinates are packed into one integer key, coordinates must be within +-OFFSET cells
+OFFSET = 1 << 24
+
+
+def _key(ix, iy):
+    return (ix + OFFSET) * (2 * OFFSET) + (iy + OFFSET)
+
+
+def _unkey(key):
+    return key // (2 * OFFSET) - OFFSET, key % (2 * OFFSET) - OFFSET
+
+
+class OccupancyGrid(object):
+    """
+    Log-odds occupancy grid. |resolution| is cell size (inches), |angles|, |offset| and |max_range| describe
+    the IR sensors. Every ray adds |hit| log-odds to its end cell and |miss| to cells it passes; values are
+    clamped to +-|limit|.
+    """
+
+    def __init__(self, angles, offset, max_range, resolution=1.0, hit=0.85, miss=-0.4, limit=4.0):
+        self.angles = np.asarray(angles, dtype=float)
+        self.offset = float(offset)
+        self.max_range = float(max_range)
+        self.resolution = float(resolution)
+        self.hit = hit
+        self.miss = miss
+        self.limit = limit
+        self.tiles = {}  # (tile x, tile y) -> TILE x TILE float32 array of log-odds
+
+        # distances of sample points along a ray, half a cell apart
+        step = 0.5 * self.resolution
+        self._steps = np.arange(int(math.ceil(self.max_range / step)) + 1) * step
+
+        self.samples = 0
+
+    @classmethod
+    def from_config(cls, config, resolution=1.0):
+        return cls(config.IR_ANGLES, config.IR_OFFSET, config.IR_RANGE, resolution)
+
+    def update(self, pose, distances):
+        """Adds one sample: robot |pose| (x, y, theta) and IR |distances| seen from it"""
+        self.update_batch([pose], [distances])
+
+    def update_batch(self, poses, distances):
+        """
+        Adds many samples at once (much faster than one by one): |poses| is a sequence of (x, y, theta),
+        |distances| a sequence of IR distance tuples. Clamping to +-limit is applied after the whole batch.
+        """
+        poses = np.asarray(poses, dtype=float).reshape(-1, 3)
+        distances = np.asarray(distances, dtype=float).reshape(len(poses), len(self.angles))
+
+        # one row per ray
+        heading = (poses[:, 2:3] + self.angles).ravel()
+        cos, sin = np.cos(heading), np.sin(heading)
+        x0 = np.repeat(poses[:, 0], len(self.angles)) + self.offset * cos
+        y0 = np.repeat(poses[:, 1], len(self.angles)) + self.offset * sin
+        distances = distances.ravel()
+        hit = distances < self.max_range
+        length = np.minimum(distances, self.max_range)
+
+        scale = 1.0 / self.resolution
+        end = _key(np.floor((x0 + length * cos) * scale).astype(np.int64),
+                   np.floor((y0 + length * sin) * scale).astype(np.int64))
+
+        # sample points of all rays: rays x steps
+        steps = self._steps
+        keys = _key(np.floor((x0[:, None] + cos[:, None] * steps) * scale).astype(np.int64),
+                    np.floor((y0[:, None] + sin[:, None] * steps) * scale).astype(np.int64))
+
+        # a ray passes a cell once: keep the first point in each cell, before the ray end, not in the end cell
+        free = steps < length[:, None]
+        free[:, 1:] &= keys[:, 1:] != keys[:, :-1]
+        free &= keys != np.where(hit, end, -1)[:, None]
+
+        free_keys = keys[free]
+        hit_keys = end[hit]
+        cells = np.concatenate((free_keys, hit_keys))
+        deltas = np.concatenate((np.full(len(free_keys), self.miss), np.full(len(hit_keys), self.hit)))
+        self._add(cells, deltas)
+
+        self.samples += len(poses)
+
+    def _add(self, cells, deltas):
+        """Adds |deltas| to log-odds of |cells| (keys, may repeat)"""
+        if not len(cells):
+            return
+        cells, index = np.unique(cells, return_inverse=True)
+        deltas = np.bincount(index, weights=deltas)
+
+        ix, iy = _unkey(cells)
+        tx, ty = ix >> TILE_BITS, iy >> TILE_BITS
+        lx, ly = ix & (TILE - 1), iy & (TILE - 1)
+
+        # group cells by tile
+        tile_keys = _key(tx, ty)
+        order = np.argsort(tile_keys, kind='mergesort')
+        tile_keys = tile_keys[order]
+        bounds = np.flatnonzero(np.diff(tile_keys)) + 1
+        for group in np.split(order, bounds):
+            first = group[0]
+            tile = self._tile(int(tx[first]), int(ty[first]), create=True)
+            tile[ly[group], lx[group]] += deltas[group]
+            np.clip(tile, -self.limit, self.limit, out=tile)
+
+    def _tile(self, tx, ty, create=False):
+        tile = self.tiles.get((tx, ty))
+        if tile is None and create:
+            tile = self.tiles[tx, ty] = np.zeros((TILE, TILE), dtype=np.float32)
+        return tile
+
+    def log_odds(self, x, y):
+        """Log-odds of the cells containing points |x|, |y| (scalars or arrays); 0 where nothing is known"""
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        ix = np.floor(x / self.resolution).astype(np.int64)
+        iy = np.floor(y / self.resolution).astype(np.int64)
+        out = np.zeros(np.broadcast(ix, iy).shape, dtype=np.float32)
+        ix, iy = np.broadcast_arrays(ix, iy)
+        tx, ty = ix >> TILE_BITS, iy >> TILE_BITS
+        for (kx, ky), tile in self.tiles.items():
+            mask = (tx == kx) & (ty == ky)
+            if mask.any():
+                out[mask] = tile[iy[mask] & (TILE - 1), ix[mask] & (TILE - 1)]
+        return out
+
+    def probability(self, x, y):
+        """Occupancy probability of the cells containing points |x|, |y|; 0.5 where nothing is known"""
+        return 1.0 / (1.0 + np.exp(-self.log_odds(x, y)))
+
+    def to_array(self):
+        """
+        Returns (log_odds, (x, y)): dense 2D array (rows are y) covering all allocated tiles, and
+        position of its corner cell (inches). Unexplored cells are 0.
+        """
+        if not self.tiles:
+            return np.zeros((0, 0), dtype=np.float32), (0., 0.)
+        keys = np.array(list(self.tiles))
+        tx0, ty0 = keys.min(axis=0)
+        tx1, ty1 = keys.max(axis=0) + 1
+        out = np.zeros(((ty1 - ty0) * TILE, (tx1 - tx0) * TILE), dtype=np.float32)
+        for (tx, ty), tile in self.tiles.items():
+            out[(ty - ty0) * TILE:(ty - ty0 + 1) * TILE, (tx - tx0) * TILE:(tx - tx0 + 1) * TILE] = tile
+        return out, (tx0 * TILE * self.resolution, ty0 * TILE * self.resolution)
+
+    @property
+    def nbytes(self):
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    def render(self, threshold=1.0):
+        """
+        Returns text picture of the map (north up): '#' occupied (log-odds above |threshold|), '.' free
+        (below -|threshold|), ' ' unknown
+        """
+        grid, _ = self.to_array()
+        rows = []
+        for row in grid[::-1]:
+            rows.append(''.join('#' if v > threshold else '.' if v < -threshold else ' ' for v in row).rstrip())
+        while rows and not rows[0]:
+            rows.pop(0)
+        while rows and not rows[-1]:
+            rows.pop()
+        return '\n'.join(rows)
+
+    def save(self, filename):
+        keys = sorted(self.tiles)
+        np.savez_compressed(
+            filename,
+            angles=self.angles,
+            params=np.array([self.offset, self.max_range, self.resolution, self.hit, self.miss, self.limit]),
+            samples=np.array([self.samples]),
+            keys=np.array(keys, dtype=np.int64).reshape(-1, 2),
+            tiles=np.array([self.tiles[k] for k in keys], dtype=np.float32).reshape(-1, TILE, TILE))
+
+    @classmethod
+    def load(cls, filename):
+        data = np.load(filename)
+        offset, max_range, resolution, hit, miss, limit = data['params']
+        grid = cls(data['angles'], offset, max_range, resolution, hit, miss, limit)
+        grid.samples = int(data['samples'][0])
+        for (tx, ty), tile in zip(data['keys'], data['tiles']):
+            grid.tiles[int(tx), int(ty)] = tile.copy()
+        return grid
+
+
+if __name__ == '__main__':
+    import argparse
+    import types
+
+    import config
+    from qb import QB
+    from qb_simple_behavior import Supervisor
+    from robot.backend import get_backend
+
+    parser = argparse.ArgumentParser(description='Map simulated arena, driving with the simple behavior')
+    parser.add_argument('--seconds', type=float, default=120.0, help='simulated time')
+    parser.add_argument('--resolution', type=float, default=2.0, help='cell size, inches')
+    parser.add_argument('--truth', action='store_true', help='use simulator pose instead of odometry')
+    parser.add_argument('-o', '--output', help='save map to this file (.npz)')
+    cmd = parser.parse_args()
+
+    cfg = types.ModuleType('config')
+    cfg.__dict__.update(vars(config))
+    cfg.BACKEND = 'sim'
+    cfg.SIM = dict(config.SIM, realtime=False)
+
+    qb = QB(cfg)
+    world = get_backend(cfg).world
+    grid = OccupancyGrid.from_config(cfg, cmd.resolution)
+    get_pose = (lambda: world.pose) if cmd.truth else qb.get_pose
+
+    supervisor = Supervisor(cfg)
+    qb.scheduler.add('behavior', lambda: supervisor(qb), cfg.BEHAVIOR_PERIOD, priority=2)
+    qb.scheduler.add('mapping', lambda: grid.update(get_pose(), qb.get_ir_distances()),
+                     cfg.BEHAVIOR_PERIOD, priority=3)
+
+    qb.start()
+    try:
+        qb.scheduler.start()
+        while world.time < cmd.seconds:
+            qb.scheduler.wait()
+    finally:
+        qb.stop()
+
+    print grid.render()
+    print '%d samples, %d tiles (%d KB)' % (grid.samples, len(grid.tiles), grid.nbytes / 1024)
+    if cmd.output:
+        grid.save(cmd.output)
+        print 'Map written to', cmd.output
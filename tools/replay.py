@@ -0,0 +1,253 @@
+"""
+Offline replay of recorded runs through the real controller code.
+
+Recorded raw sensor readings (unsigned encoder ticks and speed) and the torque that was actually applied
+to the motor are fed into robot.controller.Helper (and its PID) via fake sensor callables. Replay output
+(signed ticks and speed) is compared with what was recorded, so changes to Helper constants or PID gains
+can be evaluated on recorded data in milliseconds, without the robot:
+
+    python -m tools.replay research/speed_sign2.qbt --dt 0.04 --alpha 0.8
+
+Input is a trace (see tools/trace.py) with these columns (<side> is "left" or "right"):
+
+    timer                       ADC timer (optional; if missing, rows are assumed to be Helper.PERIOD apart)
+    raw_ticks_<side>            unsigned ticks; if missing, reconstructed from signed ticks_<side>
+    raw_speed_<side>            unsigned speed; if missing, abs(speed_<side>)
+    torque_<side> or torque     applied torque
+    reference_<side>            reference speed (optional; recordings of symmetric runs only
+                                store reference_left, it is used for both sides)
+    ticks_<side>, speed_<side>  signed values, as recorded (optional, used to compare)
+"""
+import time
+
+import numpy as np
+
+from robot.controller import Helper
+from robot.sensors import Sensors
+
+
+class Inputs(object):
+    """
+    Replay inputs of one wheel, extracted from a trace (or any mapping of column name to array)
+    """
+
+    def __init__(self, data, side='left'):
+        def get(*names):
+            for name in names:
+                if name in data:
+                    return np.asarray(data[name])
+            return None
+
+        self.timer = get('timer')
+        self.ticks = get('ticks_' + side)  # signed, as recorded
+        self.speed = get('speed_' + side)
+
+        self.raw_speed = get('raw_speed_' + side)
+        if self.raw_speed is None:
+            if self.speed is None:
+                raise ValueError('No speed_%s or raw_speed_%s column' % (side, side))
+            self.raw_speed = np.abs(self.speed)
+
+        self.raw_ticks = get('raw_ticks_' + side)
+        if self.raw_ticks is None:
+            if self.ticks is not None:
+                self.raw_ticks = np.concatenate(([0], np.cumsum(np.abs(np.diff(self.ticks)))))
+            else:
+                self.raw_ticks = np.zeros(len(self.raw_speed), dtype=np.int64)
+
+        self.torque = get('torque_' + side, 'torque')
+        if self.torque is None:
+            raise ValueError('No torque_%s or torque column' % side)
+
+        self.reference = get('reference_' + side, 'reference_left')
+        if self.reference is None:
+            self.reference = np.zeros(len(self.raw_speed))
+
+    def __len__(self):
+        return len(self.raw_speed)
+
+    @property
+    def steps(self):
+        """
+        Time since previous row in Helper.PERIOD units, as Helper computes it (first row, and all rows
+        if there is no timer column, are one period long)
+        """
+        steps = np.ones(len(self))
+        if self.timer is not None and len(self.timer) > 1:
+            timer = self.timer.astype(np.int64)
+            elapsed = (np.diff(timer) % Sensors.TIMER_MODULUS) / Sensors.TIMERTICKS_PER_SEC
+            steps[1:] = np.minimum(elapsed / Helper.PERIOD, Helper.MAX_STEP)
+        return steps
+
+    @property
+    def duration(self):
+        """Recorded time, seconds"""
+        if self.timer is None or len(self.timer) < 2:
+            return 0.
+        return (self.timer[-1] - self.timer[0]) / Sensors.TIMERTICKS_PER_SEC
+
+
+class Result(object):
+
+    def __init__(self, inputs, ticks, speed, predicted_speed, computed_torque, elapsed):
+        self.inputs = inputs
+        self.ticks = ticks
+        self.speed = speed
+        self.predicted_speed = predicted_speed
+        self.computed_torque = computed_torque
+        self.elapsed = elapsed  # seconds of wall time it took to replay
+
+    def metrics(self):
+        """
+        Returns dictionary of:
+
+            sign_agreement  fraction of moving ticks (raw speed > 0) where replayed speed has the same
+                            sign as recorded one (or as the applied torque, if there is no recorded
+                            signed speed)
+            tick_error      maximum absolute difference between replayed and recorded signed ticks
+            latency         mean time (seconds) from applied torque changing sign to replayed speed
+                            changing sign
+            recorded_latency same as above, for recorded speed
+            speedup         replay speed, times faster than real time
+        """
+        inputs = self.inputs
+        moving = inputs.raw_speed > 0
+        truth = inputs.speed if inputs.speed is not None else inputs.torque
+        agree = np.sign(self.speed[moving]) == np.sign(truth[moving])
+
+        result = {
+            'sign_agreement': float(agree.mean()) if len(agree) else 1.0,
+            'tick_error': None,
+            'latency': latency(inputs.timer, inputs.torque, self.speed),
+            'recorded_latency': None,
+            'speedup': inputs.duration / self.elapsed if self.elapsed > 0 else float('inf'),
+        }
+        if inputs.ticks is not None:
+            result['tick_error'] = int(np.abs(self.ticks - inputs.ticks).max()) if len(inputs) else 0
+        if inputs.speed is not None:
+            result['recorded_latency'] = latency(inputs.timer, inputs.torque, inputs.speed)
+        return result
+
+
+def latency(timer, torque, speed):
+    """
+    Mean time (seconds) it takes |speed| to take the sign of |torque| after torque changes sign.
+    Returns None if torque never changes sign, or speed never follows.
+    """
+    if timer is None:
+        return None
+
+    torque_sign = np.sign(torque)
+    speed_sign = np.sign(speed)
+    steps = np.nonzero((torque_sign[1:] != torque_sign[:-1]) & (torque_sign[1:] != 0))[0] + 1
+
+    delays = []
+    for step in steps:
+        follows = np.nonzero(speed_sign[step:] == torque_sign[step])[0]
+        if len(follows):
+            delays.append(timer[step + follows[0]] - timer[step])
+    if not delays:
+        return None
+    return float(np.mean(delays)) / Sensors.TIMERTICKS_PER_SEC
+
+
+def replay(data, side='left', DT=None, GAIN=None, ALPHA=None, **pid):
+    """
+    Replays recorded wheel through a fresh Helper. |DT|, |GAIN| and |ALPHA| override Helper constants,
+    other keyword arguments (Kp, Ki, integral_limit) are passed to Helper (PID gains).
+    Returns Result.
+    """
+    inputs = data if isinstance(data, Inputs) else Inputs(data, side)
+
+    # plain lists are much faster to index from python than numpy arrays
+    raw_ticks = inputs.raw_ticks.tolist()
+    raw_speed = inputs.raw_speed.tolist()
+    timer = inputs.timer.tolist() if inputs.timer is not None else None
+    torque = inputs.torque.tolist()
+    reference = inputs.reference.tolist()
+    count = len(raw_speed)
+
+    row = [0]
+    helper = Helper(speed_sensor=lambda: raw_speed[row[0]],
+                    ticks_sensor=lambda: raw_ticks[row[0]],
+                    timer_sensor=(lambda: timer[row[0]]) if timer is not None else None,
+                    dt=DT, gain=GAIN, alpha=ALPHA,
+                    **pid)
+
+    ticks = [0] * count
+    speed = [0.] * count
+    predicted_speed = [0.] * count
+    computed_torque = [0.] * count
+
+    start = time.time()
+    for i in xrange(count):
+        row[0] = i
+        helper.run(reference[i])
+        helper.on_timer(torque[i])
+        ticks[i] = helper.ticks
+        speed[i] = helper.speed
+        predicted_speed[i] = helper.predicted_speed
+        computed_torque[i] = helper.computed_torque
+    elapsed = time.time() - start
+
+    return Result(inputs, np.array(ticks), np.array(speed), np.array(predicted_speed),
+                  np.array(computed_torque), elapsed)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from tools import trace
+
+    parser = argparse.ArgumentParser(description='Replay recorded runs through Helper and PID')
+    parser.add_argument('files', nargs='+', help='trace files (.qbt)')
+    parser.add_argument('--side', choices=('left', 'right'), action='append',
+                        help='wheel(s) to replay (default: both)')
+    parser.add_argument('--dt', type=float, help='Helper.DT (default: %s)' % Helper.DT)
+    parser.add_argument('--gain', type=float, help='Helper.GAIN (default: %s)' % Helper.GAIN)
+    parser.add_argument('--alpha', type=float, help='Helper.ALPHA (default: %s)' % Helper.ALPHA)
+    parser.add_argument('--kp', type=float, help='PID proportional gain')
+    parser.add_argument('--ki', type=float, help='PID integral gain')
+    parser.add_argument('--plot', action='store_true', help='plot recorded and replayed speed')
+
+    cmd = parser.parse_args()
+
+    pid = {}
+    if cmd.kp is not None:
+        pid['Kp'] = cmd.kp
+    if cmd.ki is not None:
+        pid['Ki'] = cmd.ki
+
+    def fmt(value, pattern):
+        return 'n/a' if value is None else pattern % value
+
+    print '%-36s %-5s %6s %6s %5s %10s %10s %9s' % (
+        'trace', 'side', 'rows', 'signs', 'ticks', 'latency', 'recorded', 'speedup')
+
+    for filename in cmd.files:
+        data = trace.load(filename)
+        for side in cmd.side or ('left', 'right'):
+            result = replay(data, side, DT=cmd.dt, GAIN=cmd.gain, ALPHA=cmd.alpha, **pid)
+            m = result.metrics()
+            print '%-36s %-5s %6d %5.1f%% %5s %10s %10s %8.0fx' % (
+                filename, side, len(result.inputs), m['sign_agreement'] * 100,
+                fmt(m['tick_error'], '%d'), fmt(m['latency'], '%.3fs'),
+                fmt(m['recorded_latency'], '%.3fs'), m['speedup'])
+
+            if cmd.plot:
+                import matplotlib.pyplot as plt
+
+                inputs = result.inputs
+                t = (inputs.timer - inputs.timer[0]) / Sensors.TIMERTICKS_PER_SEC
+                plt.figure()
+                plt.title('%s (%s)' % (filename, side))
+                plt.plot(t, inputs.torque, color='b', label='torque')
+                if inputs.speed is not None:
+                    plt.plot(t, inputs.speed, color='g', label='speed (recorded)')
+                plt.plot(t, result.speed, color='r', label='speed (replay)')
+                plt.plot(t, result.predicted_speed, color='m', label='predicted speed')
+                plt.legend(loc=3)
+
+    if cmd.plot:
+        import matplotlib.pyplot as plt
+        plt.show()
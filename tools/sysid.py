@@ -0,0 +1,158 @@
+"""
+Fits motor model of robot.controller.Helper from recorded step responses.
+
+Helper predicts wheel speed with a first-order model, updated every control tick:
+
+    predicted += DT * step * (GAIN * torque - predicted + ALPHA * (measured - predicted))
+
+where step is the time since previous tick in Helper.PERIOD units (from recorded ADC timer).
+
+DT and GAIN describe the motor (torque -> speed response on a given surface). They are fit to the open-loop
+part of the model (ALPHA = 0) by least squares over all recordings of a surface. Since encoders measure
+unsigned speed, model is compared with abs(speed). For every DT on a grid all recordings are filtered at
+once (numpy, vectorized over the grid), and the best GAIN for each DT has a closed form.
+
+ALPHA is the observer gain: how much measured speed corrects the model. It trades sign detection latency
+for robustness, so it is chosen by replaying the recordings (tools/replay.py) with the fitted DT and GAIN
+and picking the value with the best sign agreement (then lowest latency).
+
+    python -m tools.sysid --surface hardwood research/speed_sign.qbt research/speed_sign2.qbt \\
+                          --surface carpet research/speed_sign2_carpet.qbt
+"""
+import json
+
+import numpy as np
+
+from robot.controller import Helper
+from tools import trace
+from tools.replay import Inputs, replay
+
+
+DT_GRID = np.linspace(0.005, 0.5, 100)
+ALPHA_GRID = np.linspace(0., 2., 21)
+
+
+def simulate(torque, dts, steps=None):
+    """
+    Open-loop response of unit-gain model to |torque| for every value of |dts|. |steps| is time
+    between samples in Helper.PERIOD units (see Inputs.steps), by default one period each.
+    Returns array of shape (len(dts), len(torque)).
+    """
+    dts = np.asarray(dts, dtype=float)
+    if steps is None:
+        steps = np.ones(len(torque))
+    out = np.empty((len(dts), len(torque)))
+    predicted = np.zeros(len(dts))
+    for i, u in enumerate(torque):
+        out[:, i] = predicted
+        predicted += dts * steps[i] * (u - predicted)
+    return out
+
+
+def fit_motor(recordings, dts=DT_GRID):
+    """
+    Fits DT and GAIN to a list of Inputs (see tools/replay.py). Returns (DT, GAIN, rms_error).
+    """
+    sxx = np.zeros(len(dts))
+    sxy = np.zeros(len(dts))
+    syy = 0.
+    count = 0
+    for inputs in recordings:
+        x = np.abs(simulate(inputs.torque, dts, inputs.steps))
+        y = inputs.raw_speed
+        sxx += np.einsum('ij,ij->i', x, x)
+        sxy += x.dot(y)
+        syy += y.dot(y)
+        count += len(y)
+
+    gains = sxy / np.where(sxx > 0, sxx, 1.)
+    sse = syy - gains * sxy
+    best = np.argmin(sse)
+    return float(dts[best]), float(gains[best]), float(np.sqrt(max(sse[best], 0.) / max(count, 1)))
+
+
+def evaluate(recordings, **params):
+    """Replays recordings with given Helper parameters, returns (sign agreement, mean latency)"""
+    agreement = []
+    latencies = []
+    for inputs in recordings:
+        m = replay(inputs, **params).metrics()
+        agreement.append(m['sign_agreement'])
+        if m['latency'] is not None:
+            latencies.append(m['latency'])
+    return float(np.mean(agreement)), float(np.mean(latencies)) if latencies else None
+
+
+def fit_alpha(recordings, DT, GAIN, alphas=ALPHA_GRID):
+    """Returns (ALPHA, sign agreement, latency) of the best ALPHA value"""
+    best = None
+    for alpha in alphas:
+        agreement, latency = evaluate(recordings, DT=DT, GAIN=GAIN, ALPHA=alpha)
+        key = (round(agreement, 3), -(latency if latency is not None else np.inf))
+        if best is None or key > best[0]:
+            best = key, float(alpha), agreement, latency
+    return best[1:]
+
+
+def load_recordings(filenames):
+    """Returns Inputs of both wheels of every trace"""
+    recordings = []
+    for filename in filenames:
+        data = trace.load(filename)
+        recordings.extend(Inputs(data, side) for side in ('left', 'right'))
+    return recordings
+
+
+def identify(recordings):
+    """Fits all Helper parameters for one surface, returns dictionary"""
+    DT, GAIN, rms = fit_motor(recordings)
+    ALPHA, agreement, latency = fit_alpha(recordings, DT, GAIN)
+    current_agreement, current_latency = evaluate(recordings)
+    return {
+        'DT': DT,
+        'GAIN': GAIN,
+        'ALPHA': ALPHA,
+        'rms_error': rms,
+        'sign_agreement': agreement,
+        'latency': latency,
+        'current_sign_agreement': current_agreement,
+        'current_latency': current_latency,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fit Helper motor model (DT, GAIN, ALPHA) per surface')
+    parser.add_argument('--surface', nargs='+', action='append', required=True, metavar=('NAME', 'TRACE'),
+                        help='surface name followed by its step response traces (.qbt)')
+    parser.add_argument('-o', '--output', help='write fitted parameters to JSON file')
+
+    cmd = parser.parse_args()
+
+    def fmt(value, pattern):
+        return 'n/a' if value is None else pattern % value
+
+    print 'Current: DT=%s GAIN=%s ALPHA=%s' % (Helper.DT, Helper.GAIN, Helper.ALPHA)
+    print '%-12s %4s %7s %6s %6s %8s   %14s %14s' % (
+        'surface', 'runs', 'DT', 'GAIN', 'ALPHA', 'rms', 'signs', 'latency')
+
+    results = {}
+    for group in cmd.surface:
+        name, filenames = group[0], group[1:]
+        if not filenames:
+            parser.error('no traces given for surface %s' % name)
+        recordings = load_recordings(filenames)
+        r = results[name] = identify(recordings)
+        print '%-12s %4d %7.3f %6.3f %6.2f %8.3f   %5.1f%% -> %4.1f%% %6s -> %5s' % (
+            name, len(filenames), r['DT'], r['GAIN'], r['ALPHA'], r['rms_error'],
+            r['current_sign_agreement'] * 100, r['sign_agreement'] * 100,
+            fmt(r['current_latency'], '%.3f'), fmt(r['latency'], '%.3f'))
+
+    print
+    print 'Signs and latency (seconds) are for current -> fitted parameters, see tools/replay.py'
+
+    if cmd.output:
+        with open(cmd.output, 'w') as f:
+            json.dump(results, f, indent=4, sort_keys=True)
+        print 'Parameters written to', cmd.output
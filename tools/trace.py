@@ -0,0 +1,253 @@
+"""
+Compact columnar binary format for recorded runs (.qbt files).
+
+Layout:
+
+    magic       8 bytes 'QBTRACE1'
+    header_size uint32, little-endian
+    header      JSON, padded with spaces to a multiple of 8 bytes
+    columns     one after another, each starting at 8-byte aligned offset
+
+Header describes the run and every column:
+
+    {"schema": "speed_sign2", "rows": 300, "columns": [
+        {"name": "timer", "kind": "int", "dtype": "<i2", "start": 2328, "offset": 0}, ...]}
+
+Float columns are stored as little-endian float64 and are opened as zero-copy memory-mapped numpy
+views. Integer columns (timer, ticks) are delta-encoded: column stores differences between consecutive
+values in the narrowest integer type that fits them, and "start" is the first value. They are
+decoded with a single cumsum().
+
+Writer is pure python (runs on the robot), reader needs numpy.
+
+Convert existing CSV files once:
+
+    python -m tools.trace convert speed_sign2 research/speed_sign2.csv
+
+and load them in plotting scripts:
+
+    trace = load('research/speed_sign2.qbt')
+    timer, speed_left = trace['timer'], trace['speed_left']
+"""
+import json
+import os
+import struct
+
+MAGIC = 'QBTRACE1'
+ALIGN = 8
+
+INT = 'int'
+FLOAT = 'float'
+
+# (name, kind) of CSV columns of known recordings. Names are the same as in robot/recorder.py,
+# so converted recordings and traces written by the recorder can be used interchangeably.
+SCHEMAS = {
+    # research/speed_sign.py
+    'speed_sign': (
+        ('timer', INT),
+        ('raw_speed_left', FLOAT),
+        ('raw_speed_right', FLOAT),
+        ('raw_ticks_left', INT),
+        ('raw_ticks_right', INT),
+        ('torque', FLOAT),
+    ),
+    # research/speed_sign2.py
+    'speed_sign2': (
+        ('timer', INT),
+        ('speed_left', FLOAT),
+        ('speed_right', FLOAT),
+        ('ticks_left', INT),
+        ('ticks_right', INT),
+        ('torque_left', FLOAT),
+        ('torque_right', FLOAT),
+        ('reference_left', FLOAT),
+    ),
+    # robot/controller.py
+    'controller': (
+        ('timer', INT),
+        ('reference_left', FLOAT),
+        ('speed_left', FLOAT),
+        ('speed_right', FLOAT),
+        ('computed_torque_left', FLOAT),
+        ('computed_torque_right', FLOAT),
+        ('torque_left', FLOAT),
+        ('torque_right', FLOAT),
+    ),
+}
+
+# struct code, numpy dtype and value range of delta-encoded integer columns, narrowest first
+_DELTA_TYPES = (
+    ('b', '<i1', 1 << 7),
+    ('h', '<i2', 1 << 15),
+    ('i', '<i4', 1 << 31),
+    ('q', '<i8', 1 << 63),
+)
+
+
+def _encode(kind, values):
+    """Returns (column header, bytes) for a list of values"""
+    if kind == FLOAT:
+        return {'kind': FLOAT, 'dtype': '<f8'}, struct.pack('<%dd' % len(values), *values)
+
+    values = [int(x) for x in values]
+    deltas = [0] + [b - a for a, b in zip(values, values[1:])]
+    limit = max([max(deltas), -min(deltas) - 1]) if deltas else 0
+    for code, dtype, size in _DELTA_TYPES:
+        if limit < size:
+            break
+    header = {'kind': INT, 'dtype': dtype, 'start': values[0] if values else 0}
+    return header, struct.pack('<%d%s' % (len(deltas), code), *deltas)
+
+
+def write(filename, schema, columns, schema_name=None):
+    """
+    Writes trace file. |schema| is a sequence of (name, kind) pairs, |columns| - sequence of
+    columns (lists or arrays of values) in the same order.
+    """
+    rows = len(columns[0]) if columns else 0
+    headers = []
+    chunks = []
+    offset = 0
+    for (name, kind), values in zip(schema, columns):
+        if len(values) != rows:
+            raise ValueError('Column %s has %d rows, expected %d' % (name, len(values), rows))
+        header, data = _encode(kind, list(values))
+        header['name'] = name
+        header['offset'] = offset
+        data += '\0' * (-len(data) % ALIGN)
+        offset += len(data)
+        headers.append(header)
+        chunks.append(data)
+
+    header = json.dumps({'schema': schema_name, 'rows': rows, 'columns': headers})
+    # magic and size take 12 bytes, pad so that data starts at aligned offset
+    header += ' ' * (-(len(MAGIC) + 4 + len(header)) % ALIGN)
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for data in chunks:
+            f.write(data)
+
+
+def read_csv(filename, schema):
+    """Reads CSV file (no header) into a list of columns"""
+    columns = [[] for _ in schema]
+    with open(filename) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for column, (_, kind), x in zip(columns, schema, line.split(',')):
+                column.append(int(float(x)) if kind == INT else float(x))
+    return columns
+
+
+def convert(filename, schema_name, output=None):
+    """Converts CSV recording to trace file, returns the name of the file written"""
+    output = output or os.path.splitext(filename)[0] + '.qbt'
+    schema = SCHEMAS[schema_name]
+    write(output, schema, read_csv(filename, schema), schema_name)
+    return output
+
+
+class Trace(object):
+    """
+    Trace file opened for reading. Columns are numpy arrays:
+
+        trace['timer'], trace.names, len(trace)
+        timer, speed = trace.columns('timer', 'speed_left')
+    """
+
+    def __init__(self, filename):
+        import numpy as np
+
+        with open(filename, 'rb') as f:
+            magic = f.read(len(MAGIC))
+            if magic != MAGIC:
+                raise ValueError('%s is not a trace file' % filename)
+            size, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(size))
+
+        self.filename = filename
+        self.schema = header['schema']
+        self.rows = header['rows']
+        self._columns = dict((c['name'], c) for c in header['columns'])
+        self.names = tuple(c['name'] for c in header['columns'])
+        self._decoded = {}
+
+        data_offset = len(MAGIC) + 4 + size
+        if os.path.getsize(filename) > data_offset:
+            self._map = np.memmap(filename, dtype=np.uint8, mode='r', offset=data_offset)
+        else:
+            self._map = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return self.rows
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __getitem__(self, name):
+        if name not in self._decoded:
+            self._decoded[name] = self._decode(self._columns[name])
+        return self._decoded[name]
+
+    def columns(self, *names):
+        return tuple(self[name] for name in (names or self.names))
+
+    def _decode(self, column):
+        import numpy as np
+
+        dtype = np.dtype(column['dtype'])
+        start = column['offset']
+        values = self._map[start:start + self.rows * dtype.itemsize].view(dtype)
+        if column['kind'] == INT:
+            values = np.cumsum(values, dtype=np.int64) + column['start']
+        return values
+
+    def to_csv(self, filename):
+        data = self.columns()
+        with open(filename, 'w') as f:
+            for row in zip(*data):
+                f.write(', '.join(str(x) for x in row) + '\n')
+
+
+def load(filename):
+    return Trace(filename)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Convert recordings between CSV and trace format')
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('convert', help='convert CSV files to trace files (.qbt next to each CSV)')
+    p.add_argument('schema', choices=sorted(SCHEMAS))
+    p.add_argument('files', nargs='+')
+
+    p = sub.add_parser('csv', help='convert trace file back to CSV')
+    p.add_argument('file')
+    p.add_argument('output')
+
+    p = sub.add_parser('info', help='print trace header')
+    p.add_argument('files', nargs='+')
+
+    cmd = parser.parse_args()
+
+    if cmd.command == 'convert':
+        for filename in cmd.files:
+            output = convert(filename, cmd.schema)
+            print '%s -> %s (%d -> %d bytes)' % (filename, output, os.path.getsize(filename), os.path.getsize(output))
+
+    elif cmd.command == 'csv':
+        load(cmd.file).to_csv(cmd.output)
+
+    else:
+        for filename in cmd.files:
+            trace = load(filename)
+            print '%s: schema %s, %d rows' % (filename, trace.schema, len(trace))
+            for name in trace.names:
+                column = trace._columns[name]
+                print '  %-24s %-6s %s' % (name, column['kind'], column['dtype'])